@@ -0,0 +1,39 @@
+"""Benchmarks for the imr.maps.coast module
+
+Run as ``python benchmarks/bench_coast.py``. The results are printed to
+standard output. The coastline data is downloaded on first use.
+"""
+
+import time
+from imr.maps import coast
+
+
+def timeit(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_merged_areas(latlim=(60, 61), lonlim=(4.5, 5.5)):
+    print(f'Coastlines, latlim={latlim}, lonlim={lonlim}')
+    data = coast.tiled_resource('kartverket')
+
+    geoms = coast.clip_layer(data, latlim, lonlim)
+    result = coast.merged_areas(geoms)
+    print(f'  {len(geoms)} input geometries, '
+          f'{result.sizes["patch_num"]} patches, '
+          f'{result.sizes["node_num"]} nodes')
+
+    elapsed = timeit(lambda: coast.clip_layer(data, latlim, lonlim))
+    print(f'  clip_layer      {elapsed * 1e3:8.1f} ms')
+    elapsed = timeit(lambda: coast.merged_areas(geoms))
+    print(f'  merged_areas    {elapsed * 1e3:8.1f} ms')
+    elapsed = timeit(lambda: coast.coastlines(latlim, lonlim))
+    print(f'  coastlines      {elapsed * 1e3:8.1f} ms')
+
+
+if __name__ == '__main__':
+    bench_merged_areas()
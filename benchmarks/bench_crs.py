@@ -0,0 +1,55 @@
+"""Benchmarks for the imr.maps.crs module
+
+Run as ``python benchmarks/bench_crs.py``. The results are printed to
+standard output.
+"""
+
+import time
+import numpy as np
+from imr.maps import crs
+
+
+def timeit(fn, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_transform_workers(num_points=4_000_000, worker_counts=(1, 2, 4, 8)):
+    print(f'crs_transform, {num_points} points')
+    rng = np.random.default_rng(0)
+    lon = rng.uniform(0, 30, num_points)
+    lat = rng.uniform(55, 72, num_points)
+    wgs84 = crs.crs_from_epsg(4326)
+    targets = dict(utm33n=crs.crs_from_epsg(25833), nk800=crs.crs_nk800())
+
+    for name, target in targets.items():
+        for workers in worker_counts:
+            elapsed = timeit(
+                lambda: crs.crs_transform(lon, lat, wgs84, target, workers=workers))
+            print(f'  {name:8s} workers={workers:<3d} '
+                  f'{num_points / elapsed / 1e6:8.2f} Mpoints/s')
+
+
+def bench_crs_construction(num_calls=1000):
+    print(f'SpatialReference construction, {num_calls} calls')
+    constructors = dict(
+        crs_nk800=(crs.crs_nk800, ()),
+        crs_nf160=(crs.crs_nf160, ('A05', )),
+        crs_local=(crs.crs_local, (5, 60)),
+        crs_from_epsg=(crs._crs_from_epsg, (25833, )),
+    )
+
+    for name, (fn, args) in constructors.items():
+        uncached = timeit(lambda: [fn.__wrapped__(*args) for _ in range(num_calls)])
+        cached = timeit(lambda: [fn(*args) for _ in range(num_calls)])
+        print(f'  {name:14s} uncached {uncached / num_calls * 1e6:8.1f} us/call'
+              f'  cached {cached / num_calls * 1e6:8.1f} us/call')
+
+
+if __name__ == '__main__':
+    bench_transform_workers()
+    bench_crs_construction()
@@ -3,7 +3,7 @@ from setuptools import setup, find_namespace_packages
 
 setup(
     name='imr_maps',
-    version='0.3.1',
+    version='0.4.0',
     packages=find_namespace_packages(where='src'),
     package_dir={'': 'src'},
     entry_points={
@@ -31,9 +31,9 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
-        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
 
         "Operating System :: OS Independent",
     ],
@@ -42,7 +42,7 @@ setup(
     description='Retrieve public data on Norwegian aquaculture locations',
     install_requires=[
         'numpy>=1.16', 'pytest', 'GDAL', 'xarray', 'netCDF4', 'PyYAML',
-        'shapely'
+        'shapely>=2.1', 'scipy'
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.10',
 )
@@ -1,3 +1,3 @@
 from .farms import areas as farm_areas, locations as farm_locations
 from .spawn import area as spawn_area
-from .coast import coastlines
+from .coast import coastlines, coastlines_batch
@@ -1,4 +1,24 @@
-import contextlib
+import collections
+import threading
+
+
+# Maximal memory used by the coastline cache, in bytes
+COASTLINE_CACHE_MAXBYTES = 256 * 2**20
+
+# Simplification tolerances, in metres, of the precomputed coarse versions
+# of the coastline tiles
+PYRAMID_LEVELS = (50, 200, 1000, 5000)
+
+# Approximate length of one degree of latitude, in metres
+_METRES_PER_DEGREE = 111320
+
+_coastline_cache = collections.OrderedDict()
+_coastline_cache_lock = threading.Lock()
+_coastline_cache_stats = dict(hits=0, misses=0, nbytes=0)
+
+# Tile store file and pyramid levels of each named resource
+_tile_stores = {}
+_tile_stores_lock = threading.Lock()
 
 
 def download_source(files, server, user=None):
@@ -56,9 +76,219 @@ def cached_resource(name):
     return resource_dir
 
 
-@contextlib.contextmanager
-def clip_layer(local_file, latlim, lonlim):
+def tiled_resource(name):
+    """
+    Return the tiled coastline store of a named resource. The store is built
+    from the downloaded data the first time the function is called.
+
+    :param name: Either 'kartverket' or 'gshhs'
+    :return: Path of the GeoPackage file containing the tiles
+    """
+    resource_dir = cached_resource(name)
+    tile_file = resource_dir.parent.joinpath(name + '_tiles.gpkg')
+    layer_names = [_level_name(t) for t in (None, ) + PYRAMID_LEVELS]
+    if not tile_file.exists() or not _has_layers(tile_file, layer_names):
+        build_tiles(resource_dir, tile_file)
+    return tile_file
+
+
+def tile_layer(tolerance=None, levels=PYRAMID_LEVELS):
+    """
+    Return the name of the tile store layer to use for a given level of
+    detail. This is the coarsest layer in the simplification pyramid whose
+    tolerance does not exceed the requested tolerance.
+
+    :param tolerance: Acceptable simplification error, in metres. If None,
+    the full-resolution layer is selected.
+    :param levels: Simplification tolerances, in metres, of the layers in
+    the tile store
+    :return: Layer name
+    """
+    levels = [t for t in levels if tolerance is not None and t <= tolerance]
+    if not levels:
+        return _level_name(None)
+    return _level_name(max(levels))
+
+
+def _level_name(tolerance):
+    """Name of the tile store layer with a given simplification tolerance"""
+    if tolerance is None:
+        return 'tiles'
+    return f'tiles_{tolerance:g}m'
+
+
+def _pyramid_levels(fname):
+    """Simplification tolerances of the layers in a tile store"""
+    import re
+    from osgeo import ogr
+    dataSource = ogr.Open(str(fname), 0)
+    names = [dataSource.GetLayerByIndex(i).GetName()
+             for i in range(dataSource.GetLayerCount())]
+    matches = [re.fullmatch(r'tiles_(.+)m', n) for n in names]
+    return [float(m.group(1)) for m in matches if m]
+
+
+def _tile_store(source):
+    """
+    Return the tile store file of a named resource, and the simplification
+    tolerances of its layers. The result is memoized, and the memo is
+    cleared whenever :func:`build_tiles` writes a tile store.
+    """
+    with _tile_stores_lock:
+        store = _tile_stores.get(source, None)
+    if store is None:
+        tile_file = tiled_resource(source)
+        store = tile_file, tuple(_pyramid_levels(tile_file))
+        with _tile_stores_lock:
+            _tile_stores[source] = store
+    return store
+
+
+def _has_layers(fname, layer_names):
+    from osgeo import ogr
+    dataSource = ogr.Open(str(fname), 0)
+    if dataSource is None:
+        return False
+    return all(dataSource.GetLayerByName(n) is not None for n in layer_names)
+
+
+def build_tiles(local_file, outfile, tilesize=1, levels=PYRAMID_LEVELS):
+    """
+    Split the geometries of a shapefile into rectangular lat/lon tiles, and
+    store the tiles in a GeoPackage file. The geometries within each tile are
+    merged. The GeoPackage spatial index makes it possible to read only
+    the tiles intersecting a given area.
+
+    In addition to the full-resolution layer 'tiles', the file contains one
+    layer per simplification level, named 'tiles_<tolerance>m', where the
+    geometries are simplified before tiling. If the source polygons form a
+    valid coverage, they are simplified as a coverage, so that edges shared
+    by neighbouring polygons stay together. Otherwise, topology is preserved
+    within each polygon only, and gaps may occur between neighbours.
+
+    :param local_file: Shapefile, or folder containing a shapefile
+    :param outfile: Name of the output GeoPackage file
+    :param tilesize: Size of each tile, in degrees
+    :param levels: Simplification tolerances, in metres
+    """
+    import shapely
+    from osgeo import ogr
+
+    levels = sorted(set(levels))
+    if any(t <= 0 for t in levels):
+        raise ValueError('Simplification tolerances must be positive')
+
+    # Read all geometries
+    bounds = [-180, -90, 180, 90]
+    geoms = clip_layer(local_file, bounds[1::2], bounds[0::2])
+    srs = _layer_srs(local_file)
+    is_coverage = len(levels) > 0 and bool(shapely.coverage_is_valid(geoms))
+
+    # Write to temporary file, and move into place when finished
+    from pathlib import Path
+    from uuid import uuid4
+    import os
+    outfile = Path(outfile)
+    tmpfile = outfile.parent.joinpath(uuid4().hex + '.gpkg')
+    driver = ogr.GetDriverByName('GPKG')
+    dataSource = driver.CreateDataSource(str(tmpfile))
+    try:
+        _write_tiles(dataSource, _level_name(None), geoms, srs, tilesize)
+        for tolerance in levels:
+            tol_degrees = tolerance / _METRES_PER_DEGREE
+            if is_coverage:
+                simplified = shapely.coverage_simplify(geoms, tol_degrees)
+            else:
+                simplified = shapely.simplify(
+                    geoms, tol_degrees, preserve_topology=True)
+            _write_tiles(
+                dataSource, _level_name(tolerance), simplified, srs, tilesize)
+        dataSource = None
+        os.replace(tmpfile, outfile)
+        with _tile_stores_lock:
+            _tile_stores.clear()
+    finally:
+        dataSource = None
+        if tmpfile.exists():
+            tmpfile.unlink()
+
+
+def _write_tiles(dataSource, name, geoms, srs, tilesize):
+    import logging
+    import numpy as np
+    import shapely
+    from osgeo import ogr
+
+    # Find tiles intersecting the geometries, and group the geometries by tile
+    tile_x, tile_y = _tile_corners(geoms, tilesize)
+    tiles = shapely.box(tile_x, tile_y, tile_x + tilesize, tile_y + tilesize)
+    tile_idx, geom_idx = shapely.STRtree(geoms).query(
+        tiles, predicate='intersects')
+    order = np.argsort(tile_idx, kind='stable')
+    tile_idx, geom_idx = tile_idx[order], geom_idx[order]
+    unique_tiles, first = np.unique(tile_idx, return_index=True)
+    geom_groups = np.split(geom_idx, first[1:])
+
+    logger = logging.getLogger(__name__)
+    logger.info(f'Building layer {name} with {len(unique_tiles)} tiles')
+    reported = 0
+
+    layer = dataSource.CreateLayer(name, srs, ogr.wkbMultiPolygon)
+    layer.CreateField(ogr.FieldDefn('tile_lon', ogr.OFTReal))
+    layer.CreateField(ogr.FieldDefn('tile_lat', ogr.OFTReal))
+    layer.StartTransaction()
+    for n, (i, group) in enumerate(zip(unique_tiles, geom_groups)):
+        percent = (100 * n) // len(unique_tiles)
+        if percent >= reported + 10:
+            logger.info(f'Building layer {name}: {percent} %')
+            reported = percent
+
+        x0, y0 = tile_x[i], tile_y[i]
+        pieces = shapely.clip_by_rect(
+            geoms[group], x0, y0, x0 + tilesize, y0 + tilesize)
+        polys = _polygons(pieces)
+        if len(polys) == 0:
+            continue
+
+        merged = shapely.multipolygons(_polygons(shapely.union_all(polys)))
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('tile_lon', float(x0))
+        feature.SetField('tile_lat', float(y0))
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(merged.wkb))
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+
+
+def _tile_corners(geoms, tilesize):
+    """Lower left corners of the tiles covering the bounding box"""
+    import numpy as np
+    import shapely
+    if len(geoms) == 0:
+        return np.empty(0), np.empty(0)
+    xmin, ymin, xmax, ymax = shapely.total_bounds(geoms)
+    tile_x = np.arange(np.floor(xmin / tilesize), np.ceil(xmax / tilesize))
+    tile_y = np.arange(np.floor(ymin / tilesize), np.ceil(ymax / tilesize))
+    tile_x, tile_y = np.meshgrid(tile_x * tilesize, tile_y * tilesize)
+    return tile_x.ravel(), tile_y.ravel()
+
+
+def _layer_srs(local_file):
+    from osgeo import ogr
+    dataSource = ogr.Open(str(_find_datafile(local_file)), 0)
+    srs = dataSource.GetLayer().GetSpatialRef()
+    return srs.Clone() if srs is not None else None
 
+
+def _polygons(geoms):
+    """Return the individual polygons of a collection of geometries"""
+    import numpy as np
+    import shapely
+    parts = shapely.get_parts(np.atleast_1d(np.asarray(geoms, dtype=object)))
+    is_polygon = shapely.get_type_id(parts) == shapely.GeometryType.POLYGON
+    return parts[is_polygon & ~shapely.is_empty(parts)]
+
+
+def _find_datafile(local_file):
     # Check if the input is a shapefile folder
     from pathlib import Path
     localpath = Path(local_file)
@@ -69,74 +299,92 @@ def clip_layer(local_file, latlim, lonlim):
             localpath = shapefile_within[0]
         else:
             localpath = files_within[0]
+    return localpath
 
-    # Create output shapefile folder
-    import subprocess
-    import shlex
-    from uuid import uuid4
-    import os
-    outdir = 'clip_layer_' + uuid4().hex + uuid4().hex
-    os.mkdir(outdir)
 
-    try:
-        outfile = Path(outdir).joinpath('clip_layer.shp')
-        spatlim = f'{lonlim[0]} {latlim[0]} {lonlim[1]} {latlim[1]}'
-        cmd = (f'ogr2ogr -spat {spatlim} -clipsrc spat_extent '
-               f'"{outfile}" "{localpath}"')
-        subprocess.run(shlex.split(cmd), capture_output=True)
+def clip_layer(local_file, latlim, lonlim, layer_name=None):
+    """
+    Read the geometries of a shapefile which are within a rectangular lat/lon
+    section, clipped to the section.
 
-        yield outdir
-    finally:
-        for f in os.listdir(outdir):
-            try:
-                os.unlink(os.path.join(outdir, f))
-            except OSError:
-                pass
-        try:
-            os.rmdir(outdir)
-        except OSError:
-            pass
-
-
-def merged_areas(shapefolder):
-    # Find shapefile
-    from pathlib import Path
-    p = Path(shapefolder)
-    shapefile = str(list(p.glob('*.shp'))[0])
+    :param local_file: Shapefile or tile store, or folder containing a
+        shapefile
+    :param latlim: A two-element list of latitude limits
+    :param lonlim: A two-element list of longitude limits
+    :param layer_name: Name of the layer to read. If None, the first layer is
+        used.
+    :return: A numpy array of shapely geometries
+    """
+    localpath = _find_datafile(local_file)
 
-    # Load shapefile
+    # Read features intersecting the rectangle, using the spatial index of
+    # the data source if available
     from osgeo import ogr
-    driver = ogr.GetDriverByName('ESRI Shapefile')
-    dataSource = driver.Open(shapefile, 0)
-    layer = dataSource.GetLayer()
-
-    # Extract polygons
-    from shapely import wkb
-    from shapely import geometry
-    polys = []
-    for feature in layer:
-        geom = wkb.loads(feature.GetGeometryRef().ExportToWkb())
-        if isinstance(geom, geometry.Polygon):
-            polys.append(geom)
-        else:
-            polys += list(geom)
+    dataSource = ogr.Open(str(localpath), 0)
+    if dataSource is None:
+        raise OSError(f'Cannot open {localpath}')
+    if layer_name is None:
+        layer = dataSource.GetLayer()
+    else:
+        layer = dataSource.GetLayerByName(layer_name)
+        if layer is None:
+            raise OSError(f'No layer named {layer_name} in {localpath}')
+    layer.SetSpatialFilterRect(lonlim[0], latlim[0], lonlim[1], latlim[1])
+    wkbs = [f.GetGeometryRef().ExportToWkb() for f in layer
+            if f.GetGeometryRef() is not None]
+
+    # Clip geometries to the rectangle
+    import numpy as np
+    import shapely
+    geoms = shapely.from_wkb(np.array(wkbs, dtype=object))
+    clipped = shapely.clip_by_rect(
+        geoms, lonlim[0], latlim[0], lonlim[1], latlim[1])
+    return clipped[~shapely.is_empty(clipped)]
+
+
+def merged_areas(geoms):
+    """
+    Combine intersecting polygons, and return the result in the format of
+    :func:`coastlines`.
 
-    # Combine intersecting polygons
-    from shapely import ops
-    uni = ops.cascaded_union(polys)
-    if isinstance(uni, geometry.Polygon):
-        uni = geometry.MultiPolygon([uni])
+    :param geoms: Shapely geometries, such as returned by :func:`clip_layer`.
+        For compatibility with earlier versions, a shapefile or a folder
+        containing a shapefile is also accepted, in which case all its
+        geometries are used.
+    :return: An xarray dataset, as returned by :func:`coastlines`
+    """
+    import os
+    if isinstance(geoms, (str, os.PathLike)):
+        geoms = clip_layer(geoms, [-90, 90], [-180, 180])
+    return _coast_dataset(merged_geometry(geoms))
+
+
+def merged_geometry(geoms):
+    """Combine intersecting polygons into a single MultiPolygon"""
+    import shapely
+    polys = _polygons(geoms)
+    uni = shapely.union_all(polys)
+    return shapely.multipolygons(_polygons(uni))
 
-    # Extract coordinates
+
+def _coast_dataset(uni):
+    # Extract coordinates of all rings, where the exterior ring of each
+    # polygon is followed by its interior rings. As required by the CF
+    # conventions, exterior rings are anticlockwise and interior rings are
+    # clockwise.
     import numpy as np
-    coords = [np.array(g.exterior.coords.xy).T for g in uni]
-    coords_len = [len(c) for c in coords]
-    if coords:
-        coords_concat = np.concatenate(coords)
-    else:
-        coords_concat = np.empty((0, 2), dtype=float)
+    import shapely
+    polys = shapely.orient_polygons(_polygons(uni), exterior_cw=False)
+    rings = shapely.get_rings(polys)
+    coords_concat = shapely.get_coordinates(rings)
+    patchsize = shapely.get_num_coordinates(polys).astype(np.int32)
+    part_node_count = shapely.get_num_coordinates(rings).astype(np.int32)
+    num_parts = shapely.get_num_interior_rings(polys) + 1
+    interior_ring = np.ones(len(rings), dtype=np.int32)
+    interior_ring[np.cumsum(num_parts) - num_parts] = 0
 
-    # Create xarray with metadata
+    # Create xarray with metadata, using the CF conventions for polygon
+    # geometries
     import xarray as xr
     return xr.Dataset({
         'latitude': xr.DataArray(
@@ -160,27 +408,660 @@ def merged_areas(shapefolder):
         ),
 
         'patchsize': xr.DataArray(
-            coords_len,
+            patchsize,
             dims='patch_num',
             name='patchsize',
             attrs=dict(
+                long_name='count of coordinates in each polygon',
                 sample_dimension='node_num',
             ),
         ),
+
+        'part_node_count': xr.DataArray(
+            part_node_count,
+            dims='part_num',
+            name='part_node_count',
+            attrs=dict(
+                long_name='count of coordinates in each polygon ring',
+            ),
+        ),
+
+        'interior_ring': xr.DataArray(
+            interior_ring,
+            dims='part_num',
+            name='interior_ring',
+            attrs=dict(
+                long_name='type of each polygon ring',
+                flag_values=np.array([0, 1], dtype=np.int32),
+                flag_meanings='exterior_ring interior_ring',
+            ),
+        ),
+
+        'geometry_container': xr.DataArray(
+            np.int32(0),
+            name='geometry_container',
+            attrs=dict(
+                geometry_type='polygon',
+                node_count='patchsize',
+                node_coordinates='longitude latitude',
+                part_node_count='part_node_count',
+                interior_ring='interior_ring',
+            ),
+        ),
     })
 
 
-def coastlines(latlim, lonlim, source='kartverket'):
+def dataset_geometry(dset):
+    """
+    Convert the output of :func:`coastlines` back to a MultiPolygon.
+
+    :param dset: A dataset returned by :func:`coastlines`
+    :return: A shapely MultiPolygon
+    """
+    import numpy as np
+    import shapely
+
+    coords = np.stack(
+        [dset.longitude.values, dset.latitude.values], axis=1)
+    if 'part_node_count' in dset.variables:
+        ring_counts = dset.part_node_count.values
+        interior_ring = dset.interior_ring.values
+    else:
+        ring_counts = dset.patchsize.values
+        interior_ring = np.zeros(len(ring_counts), dtype=np.int32)
+
+    ring_index = np.repeat(np.arange(len(ring_counts)), ring_counts)
+    rings = shapely.linearrings(coords, indices=ring_index)
+    polygon_index = np.cumsum(interior_ring == 0) - 1
+    polys = shapely.polygons(rings, indices=polygon_index)
+    return shapely.multipolygons(polys)
+
+
+class LandMask:
+    """
+    Fast point-in-land queries for a set of land polygons.
+
+    The bounding box of the polygons is divided into a grid of cells, where
+    each cell is classified as land, water or coastal. Positions in land or
+    water cells are answered by a table lookup, and only positions in
+    coastal cells are tested against the prepared polygons. Use
+    :meth:`from_dataset` to create a mask from the output of
+    :func:`coastlines`, or :meth:`from_source` to read the polygons directly
+    from the tiled coastline store.
+
+    :param geometry: A shapely geometry, or collection of geometries,
+    containing the land polygons
+    :param cells_per_node: Number of lookup cells per polygon coordinate
+    """
+
+    _WATER, _LAND, _COASTAL = 0, 1, 2
+
+    def __init__(self, geometry, cells_per_node=16):
+        import numpy as np
+        import shapely
+        self.geometry = shapely.multipolygons(_polygons(geometry))
+        shapely.prepare(self.geometry)
+
+        # Define lookup grid with approximately square cells
+        if self.geometry.is_empty:
+            self._bounds = (0., 0., 1., 1.)
+            self._table = np.zeros((1, 1), dtype=np.int8)
+            return
+        xmin, ymin, xmax, ymax = self.geometry.bounds
+        width = max(xmax - xmin, 1e-12)
+        height = max(ymax - ymin, 1e-12)
+        num_cells = cells_per_node * shapely.get_num_coordinates(self.geometry)
+        cellsize = max(np.sqrt(width * height / num_cells), 1e-9)
+        nx = int(np.ceil(width / cellsize))
+        ny = int(np.ceil(height / cellsize))
+        self._bounds = (xmin, ymin, width / nx, height / ny)
+
+        # Mark cells touched by the coastline as coastal. The coastline is
+        # densified such that a segment crosses at most the neighbouring
+        # cells of its endpoints.
+        rings = shapely.segmentize(
+            shapely.get_rings(_polygons(self.geometry)), min(self._bounds[2:]))
+        ix, iy = self._cell_index(*shapely.get_coordinates(rings).T)
+        ix = np.clip(ix, 0, nx - 1)
+        iy = np.clip(iy, 0, ny - 1)
+        coastal = np.zeros((ny + 2, nx + 2), dtype=bool)
+        for dx in (0, 1, 2):
+            for dy in (0, 1, 2):
+                coastal[iy + dy, ix + dx] = True
+        coastal = coastal[1:-1, 1:-1]
+
+        # Classify the remaining cells using the cell centers
+        table = np.full((ny, nx), self._COASTAL, dtype=np.int8)
+        cy, cx = np.nonzero(~coastal)
+        center_x = xmin + (cx + 0.5) * self._bounds[2]
+        center_y = ymin + (cy + 0.5) * self._bounds[3]
+        table[cy, cx] = shapely.contains_xy(self.geometry, center_x, center_y)
+        self._table = table
+
+    def _cell_index(self, lon, lat):
+        import numpy as np
+        xmin, ymin, dx, dy = self._bounds
+        ix = np.floor((lon - xmin) / dx).astype(np.intp)
+        iy = np.floor((lat - ymin) / dy).astype(np.intp)
+        return ix, iy
+
+    @classmethod
+    def from_dataset(cls, dset):
+        """
+        Create land mask from the output of :func:`coastlines`.
+
+        :param dset: A dataset returned by :func:`coastlines`
+        :return: A new LandMask object
+        """
+        return cls(dataset_geometry(dset))
+
+    @classmethod
+    def from_source(cls, latlim, lonlim, source='kartverket'):
+        """
+        Create land mask for a rectangular lat/lon section.
+
+        :param latlim: A two-element list of latitude limits
+        :param lonlim: A two-element list of longitude limits
+        :param source: Either 'kartverket' (high-resolution) or 'gshhs'
+        (low-resolution)
+        :return: A new LandMask object
+        """
+        return cls(_coast_geometry(latlim, lonlim, source))
+
+    def is_on_land(self, lon, lat):
+        """
+        Check if positions are on land.
+
+        :param lon: Longitude of the positions
+        :param lat: Latitude of the positions
+        :return: A boolean array with the same shape as the input, which is
+        True for positions strictly inside the land polygons. Positions with
+        non-finite coordinates are not on land.
+        """
+        import numpy as np
+        import shapely
+        lon, lat = np.broadcast_arrays(
+            np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+
+        ny, nx = self._table.shape
+        finite = np.isfinite(lon) & np.isfinite(lat)
+        ix, iy = self._cell_index(lon[finite], lat[finite])
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        selected = finite.copy()
+        selected[finite] = inside
+        state = np.full(lon.shape, self._WATER, dtype=np.int8)
+        state[selected] = self._table[iy[inside], ix[inside]]
+
+        result = state == self._LAND
+        coastal = state == self._COASTAL
+        result[coastal] = shapely.contains_xy(
+            self.geometry, lon[coastal], lat[coastal])
+        return result
+
+
+def distance_to_coast(lon, lat, coast, workers=None, clip_box=None):
+    """
+    Compute the distance from a set of positions to the nearest coastline.
+
+    The coastline is split into line segments which are indexed once, in a
+    local metric coordinate system centered on the coastline. The distance
+    is measured to the coastline itself, also for positions on land.
+
+    Land polygons which are clipped to a rectangular area have artificial
+    edges along the boundary of the area. Segments on the boundary are not
+    regarded as coastline. The boundary is given by `clip_box`, or taken
+    from the attributes of a dataset returned by :func:`coastlines`.
+
+    :param lon: Longitude of the positions
+    :param lat: Latitude of the positions
+    :param coast: A dataset returned by :func:`coastlines`, or a shapely
+    geometry containing the land polygons
+    :param workers: Number of worker threads. Default is to use the calling
+    thread only.
+    :param clip_box: A tuple (latlim, lonlim) of the area which the land
+    polygons are clipped to
+    :return: A tuple (distance, nearest_lon, nearest_lat), where 'distance'
+    is the distance in meters and 'nearest_lon', 'nearest_lat' are the
+    coordinates of the nearest coastline point. The arrays have the same
+    shape as the input. For positions which are NaN, the distance is
+    infinite and the coordinates are NaN.
+    """
+    import numpy as np
+    import shapely
+    import xarray as xr
+    from imr.maps import crs
+
+    if isinstance(coast, xr.Dataset):
+        if clip_box is None:
+            clip_box = _clip_box(coast)
+        coast = dataset_geometry(coast)
+    rings = shapely.get_rings(_polygons(coast))
+
+    lon, lat = np.broadcast_arrays(
+        np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+    distance = np.full(lon.shape, np.inf)
+    nearest_lon = np.full(lon.shape, np.nan)
+    nearest_lat = np.full(lon.shape, np.nan)
+    if len(rings) == 0 or lon.size == 0:
+        return distance, nearest_lon, nearest_lat
+
+    # Convert coastline to local metric coordinates
+    xmin, ymin, xmax, ymax = shapely.total_bounds(rings)
+    wgs84 = crs.crs_from_epsg('wgs84')
+    local = crs.crs_local(lon=(xmin + xmax) / 2, lat=(ymin + ymax) / 2)
+    coords, ring_idx = shapely.get_coordinates(rings, return_index=True)
+    x, y = crs.crs_transform(coords[:, 0], coords[:, 1], wgs84, local)
+
+    # Split into line segments, except those on the clipping boundary, and
+    # build spatial index
+    is_segment = ring_idx[:-1] == ring_idx[1:]
+    if clip_box is not None:
+        (lat0, lat1), (lon0, lon1) = clip_box
+        for c, limit in [(0, lon0), (0, lon1), (1, lat0), (1, lat1)]:
+            on_edge = coords[:, c] == limit
+            is_segment &= ~(on_edge[:-1] & on_edge[1:])
+    seg_start = np.stack([x[:-1], y[:-1]], axis=1)[is_segment]
+    seg_stop = np.stack([x[1:], y[1:]], axis=1)[is_segment]
+    segments = shapely.linestrings(np.stack([seg_start, seg_stop], axis=1))
+    tree = shapely.STRtree(segments)
+
+    def compute(chunk):
+        px, py = crs.crs_transform(lon.flat[chunk], lat.flat[chunk], wgs84, local)
+
+        # Positions which are NaN or not transformable are skipped by the
+        # query, and the input index tells which positions were found
+        points = shapely.points(px, py)
+        points[~(np.isfinite(px) & np.isfinite(py))] = None
+        (idx, seg), dist = tree.query_nearest(
+            points, return_distance=True, all_matches=False)
+        px, py = px[idx], py[idx]
+
+        # Project positions onto nearest segment
+        a = seg_start[seg]
+        ab = seg_stop[seg] - a
+        ap = np.stack([px, py], axis=1) - a
+        ab2 = np.sum(ab * ab, axis=1)
+        t = np.sum(ap * ab, axis=1) / np.where(ab2 > 0, ab2, 1)
+        q = a + np.clip(t, 0, 1)[:, np.newaxis] * ab
+        qlon, qlat = crs.crs_transform(q[:, 0], q[:, 1], local, wgs84)
+
+        flat_idx = np.arange(lon.size)[chunk][idx]
+        distance.flat[flat_idx] = dist
+        nearest_lon.flat[flat_idx] = qlon
+        nearest_lat.flat[flat_idx] = qlat
+
+    chunksize = crs.CHUNK_SIZE
+    chunks = [slice(i, i + chunksize) for i in range(0, lon.size, chunksize)]
+    crs._parallel_map(compute, chunks, workers)
+    return distance, nearest_lon, nearest_lat
+
+
+def land_mask(x, y, grid_crs, source='kartverket', supersample=1,
+              tilesize=512):
+    """
+    Rasterize coastlines onto a regular grid, such as a NorKyst800 or
+    NorFjords160 model grid.
+
+    The grid is processed in tiles, and for each tile only the coastlines
+    within the tile are read and rasterized. If ``supersample`` is greater
+    than one, each grid cell is divided into supersample x supersample
+    subcells, and the result is the fraction of subcells on land.
+
+    Example, for the full NorKyst800 grid:
+    ``land_mask(np.arange(2602), np.arange(902), crs.crs_nk800())``
+
+    :param x: One-dimensional, regularly spaced x coordinates of the grid
+    cell centers, in the units of the grid coordinate system
+    :param y: One-dimensional, regularly spaced y coordinates of the grid
+    cell centers, in the units of the grid coordinate system
+    :param grid_crs: Coordinate system of the grid (osgeo.osr.SpatialReference)
+    :param source: Either 'kartverket' (high-resolution) or 'gshhs'
+    (low-resolution)
+    :param supersample: Number of subcells per cell in each direction
+    :param tilesize: Number of cells in each direction per tile
+    :return: An xarray DataArray with dimensions ('y', 'x'), containing the
+    land fraction of each cell
+    """
+    import numpy as np
+    import shapely
+    import xarray as xr
+    from imr.maps import crs
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    dx = (x[-1] - x[0]) / (len(x) - 1) if len(x) > 1 else 1.
+    dy = (y[-1] - y[0]) / (len(y) - 1) if len(y) > 1 else 1.
+    wgs84 = crs.crs_from_epsg('wgs84')
+
+    def to_grid(coords):
+        return np.stack(crs.crs_transform(
+            coords[:, 0], coords[:, 1], wgs84, grid_crs), axis=1)
+
+    result = np.zeros((len(y), len(x)), dtype=np.float32)
+    for j0 in range(0, len(y), tilesize):
+        for i0 in range(0, len(x), tilesize):
+            tile_x = x[i0:i0 + tilesize]
+            tile_y = y[j0:j0 + tilesize]
+            x0 = tile_x[0] - dx / 2
+            y0 = tile_y[0] - dy / 2
+
+            # Find lat/lon extent of the tile, by sampling its boundary
+            t = np.linspace(0, 1, 33)
+            edge_x = x0 + dx * len(tile_x) * np.concatenate([t, t, 0 * t, 1 + 0 * t])
+            edge_y = y0 + dy * len(tile_y) * np.concatenate([0 * t, 1 + 0 * t, t, t])
+            edge_lon, edge_lat = crs.crs_transform(edge_x, edge_y, grid_crs, wgs84)
+            margin = 0.01 * (np.ptp(edge_lat) + np.ptp(edge_lon))
+            latlim = [np.min(edge_lat) - margin, np.max(edge_lat) + margin]
+            lonlim = [np.min(edge_lon) - margin, np.max(edge_lon) + margin]
+
+            # Rasterize coastlines of the tile
+            geom = _coast_geometry(latlim, lonlim, source)
+            if geom.is_empty:
+                continue
+            geom = shapely.transform(geom, to_grid)
+            raster = _rasterize(
+                geom, x0, y0, dx / supersample, dy / supersample,
+                len(tile_x) * supersample, len(tile_y) * supersample)
+            raster = raster.reshape(
+                (len(tile_y), supersample, len(tile_x), supersample))
+            result[j0:j0 + len(tile_y), i0:i0 + len(tile_x)] = raster.mean(
+                axis=(1, 3))
+
+    return xr.DataArray(
+        result, dims=('y', 'x'), coords=dict(x=x, y=y), name='land_fraction',
+        attrs=dict(long_name='fraction of grid cell on land', units='1'),
+    )
+
+
+def land_mask_from_dataset(dset, coords=None, grid_mapping=None,
+                           source='kartverket', supersample=1, tilesize=512):
+    """
+    Rasterize coastlines onto the grid of a dataset, such as a NorKyst800 or
+    NorFjords160 model output file. See :func:`land_mask`.
+
+    By default, the grid is taken from the first data variable which has a
+    'grid_mapping' attribute, and the coordinates are the last two
+    dimensions of this variable. The grid must be given by one-dimensional
+    projected coordinates. Grids given only by two-dimensional longitude and
+    latitude variables are not supported.
+
+    :param dset: Dataset containing the grid
+    :param coords: Names of the one-dimensional (x, y) coordinates
+    :param grid_mapping: Name of grid_mapping variable, or a
+        SpatialReference object
+    :param source: Either 'kartverket' (high-resolution) or 'gshhs'
+    (low-resolution)
+    :param supersample: Number of subcells per cell in each direction
+    :param tilesize: Number of cells in each direction per tile
+    :return: An xarray DataArray with the same coordinates as the grid,
+    containing the land fraction of each cell
+    """
+    import xarray as xr
+    from imr.maps import crs
+
+    if coords is None or grid_mapping is None:
+        gridded = [v for v in dset.data_vars.values()
+                   if 'grid_mapping' in v.attrs and v.ndim >= 2]
+        if not gridded:
+            raise ValueError('No variable with a grid_mapping attribute')
+        if coords is None:
+            coords = [gridded[0].dims[-1], gridded[0].dims[-2]]
+        if grid_mapping is None:
+            grid_mapping = gridded[0].attrs['grid_mapping']
+
+    _, grid_crs = crs._load_crs(dset, grid_mapping)
+    missing = [c for c in coords if c not in dset.variables]
+    if missing:
+        raise ValueError(f'No coordinate variable named {missing[0]}')
+    x = dset.variables[coords[0]]
+    y = dset.variables[coords[1]]
+    if x.ndim != 1 or y.ndim != 1:
+        raise ValueError(
+            f'The grid coordinates {coords[0]} and {coords[1]} must be '
+            'one-dimensional')
+    mask = land_mask(x.values, y.values, grid_crs, source, supersample, tilesize)
+
+    attrs = dict(mask.attrs)
+    if isinstance(grid_mapping, str):
+        attrs['grid_mapping'] = grid_mapping
+    return xr.DataArray(
+        mask.values, dims=y.dims + x.dims,
+        coords={coords[0]: x, coords[1]: y},
+        name=mask.name, attrs=attrs,
+    )
+
+
+def _rasterize(geom, x0, y0, dx, dy, nx, ny):
+    """Burn a geometry into an in-memory raster, where pixel (j, i) has
+    its lower left corner at (x0 + i * dx, y0 + j * dy)"""
+    from osgeo import gdal, ogr
+
+    raster = gdal.GetDriverByName('MEM').Create('', nx, ny, 1, gdal.GDT_Byte)
+    raster.SetGeoTransform((x0, dx, 0, y0, 0, dy))
+
+    vector = ogr.GetDriverByName('Memory').CreateDataSource('')
+    layer = vector.CreateLayer('land', None, ogr.wkbMultiPolygon)
+    feature = ogr.Feature(layer.GetLayerDefn())
+    feature.SetGeometry(ogr.CreateGeometryFromWkb(geom.wkb))
+    layer.CreateFeature(feature)
+
+    gdal.RasterizeLayer(raster, [1], layer, burn_values=[1])
+    return raster.GetRasterBand(1).ReadAsArray()
+
+
+def coastlines(latlim, lonlim, source='kartverket', cache=False,
+               tolerance=None):
     """
     Retrieve a rectangular lat/lon section of coastlines.
 
     :param latlim: A two-element list of latitude limits
     :param lonlim: A two-element list of longitude limits
     :param source: Either 'kartverket' (high-resolution) or 'gshhs' (low-resolution)
+    :param cache: If True, keep the result in an in-memory cache. Later calls
+    with the same area, or an area contained in a cached area, are served
+    from the cache.
+    :param tolerance: Acceptable simplification error, in metres. If given,
+    the coastlines are read from the coarsest precomputed simplification
+    level not exceeding the tolerance (see PYRAMID_LEVELS), which is much
+    faster for large areas. Topology is preserved by the simplification.
     :return: An xarray dataset with variables 'latitude', 'longitude',
-    'patchsize', where 'latitude', 'longitude' are the land patch coordinates
-    and 'patchsize' is the number of coordinates per land patch.
+    'patchsize', 'part_node_count' and 'interior_ring', where 'latitude',
+    'longitude' are the land patch coordinates and 'patchsize' is the number
+    of coordinates per land patch. Each land patch consists of an exterior
+    ring, followed by any interior rings (lakes). The number of coordinates
+    in each ring is given by 'part_node_count', and 'interior_ring' is 1 for
+    interior rings and 0 otherwise. The layout follows the CF conventions
+    for polygon geometries.
+    """
+    if cache:
+        uni = _cached_coast_geometry(latlim, lonlim, source, tolerance)
+    else:
+        uni = _coast_geometry(latlim, lonlim, source, tolerance)
+    return _set_clip_box(_coast_dataset(uni), latlim, lonlim)
+
+
+def _set_clip_box(dset, latlim, lonlim):
+    """Record the clipping area in the dataset attributes"""
+    dset.attrs.update(
+        geospatial_lat_min=float(latlim[0]), geospatial_lat_max=float(latlim[1]),
+        geospatial_lon_min=float(lonlim[0]), geospatial_lon_max=float(lonlim[1]),
+    )
+    return dset
+
+
+def _clip_box(dset):
+    """Return the clipping area recorded by :func:`_set_clip_box`, if any"""
+    names = ['geospatial_lat_min', 'geospatial_lat_max',
+             'geospatial_lon_min', 'geospatial_lon_max']
+    if not all(n in dset.attrs for n in names):
+        return None
+    lat0, lat1, lon0, lon1 = [dset.attrs[n] for n in names]
+    return (lat0, lat1), (lon0, lon1)
+
+
+def coastlines_batch(boxes, source='kartverket', workers=None,
+                     tolerance=None):
+    """
+    Retrieve coastlines for many rectangular lat/lon sections at once.
+
+    The tiles intersecting any of the sections are read once, split into
+    individual polygons and put into a single spatial index. The polygons
+    intersecting each section are clipped to the section, and then merged
+    separately for each section, optionally using a pool of worker
+    processes.
+
+    :param boxes: A list of (latlim, lonlim) tuples, where 'latlim' and
+    'lonlim' are two-element lists of latitude and longitude limits
+    :param source: Either 'kartverket' (high-resolution) or 'gshhs'
+    (low-resolution)
+    :param workers: Number of worker processes. Default is to use the calling
+    process only.
+    :param tolerance: Acceptable simplification error, in metres. See
+    :func:`coastlines`.
+    :return: A list of xarray datasets, one per section, in the same format
+    as returned by :func:`coastlines`
+    """
+    import numpy as np
+    import shapely
+
+    boxes = [(list(latlim), list(lonlim)) for latlim, lonlim in boxes]
+    if len(boxes) == 0:
+        return []
+
+    # Read the tiles intersecting the sections, and index the polygons
+    lims = np.array([latlim + lonlim for latlim, lonlim in boxes])
+    rects = shapely.box(lims[:, 2], lims[:, 0], lims[:, 3], lims[:, 1])
+    polys = _polygons(_read_box_geometries(rects, source, tolerance))
+    box_idx, poly_idx = shapely.STRtree(polys).query(
+        rects, predicate='intersects')
+
+    # Clip the polygons of each section, so that only the relevant parts
+    # are sent to the workers
+    order = np.argsort(box_idx, kind='stable')
+    splits = np.searchsorted(box_idx[order], np.arange(1, len(boxes)))
+    tasks = [
+        _polygons(shapely.clip_by_rect(polys[idx], lon0, lat0, lon1, lat1))
+        for idx, (lat0, lat1, lon0, lon1)
+        in zip(np.split(poly_idx[order], splits), lims)
+    ]
+
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        results = [_merge_box(task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_merge_box, tasks, chunksize=chunksize))
+
+    return [_set_clip_box(dset, latlim, lonlim)
+            for dset, (latlim, lonlim) in zip(results, boxes)]
+
+
+def _merge_box(geoms):
+    """Merge the clipped geometries of a single section. Defined at module
+    level so that it can be sent to worker processes."""
+    return merged_areas(geoms)
+
+
+def _read_box_geometries(rects, source, tolerance=None):
+    """Read the tiles intersecting any of the rectangles, without clipping"""
+    import numpy as np
+    import shapely
+    from osgeo import ogr
+
+    data, levels = _tile_store(source)
+    dataSource = ogr.Open(str(data), 0)
+    if dataSource is None:
+        raise OSError(f'Cannot open {data}')
+    layer = dataSource.GetLayerByName(tile_layer(tolerance, levels))
+    region = shapely.union_all(rects)
+    layer.SetSpatialFilter(ogr.CreateGeometryFromWkb(region.wkb))
+    wkbs = [f.GetGeometryRef().ExportToWkb() for f in layer
+            if f.GetGeometryRef() is not None]
+    return shapely.from_wkb(np.array(wkbs, dtype=object))
+
+
+def _read_geometries(latlim, lonlim, source, tolerance=None, store=None):
+    # Download and split data into tiles, unless already done
+    data, levels = store or _tile_store(source)
+    level = tile_layer(tolerance, levels)
+    return clip_layer(data, latlim, lonlim, level)  # Clip
+
+
+def _coast_geometry(latlim, lonlim, source, tolerance=None, store=None):
+    geoms = _read_geometries(latlim, lonlim, source, tolerance, store)
+    return merged_geometry(geoms)  # Merge disjoint land areas
+
+
+def _cached_coast_geometry(latlim, lonlim, source, tolerance=None):
+    import shapely
+    store = _tile_store(source)
+    level = tile_layer(tolerance, store[1])
+    key = (source, level, latlim[0], latlim[1], lonlim[0], lonlim[1])
+
+    # Look for the requested area, or a cached area which contains it
+    with _coastline_cache_lock:
+        if key in _coastline_cache:
+            container = key
+        else:
+            container = next(
+                (k for k in reversed(_coastline_cache) if _contains(k, key)),
+                None)
+
+        if container is None:
+            _coastline_cache_stats['misses'] += 1
+        else:
+            _coastline_cache_stats['hits'] += 1
+            _coastline_cache.move_to_end(container)
+            cached_uni = _coastline_cache[container][0]
+
+    if container == key:
+        return cached_uni
+    elif container is not None:
+        clipped = shapely.clip_by_rect(
+            cached_uni, lonlim[0], latlim[0], lonlim[1], latlim[1])
+        return shapely.multipolygons(_polygons(clipped))
+
+    uni = _coast_geometry(latlim, lonlim, source, tolerance, store)
+    nbytes = 16 * shapely.get_num_coordinates(uni) + 100
+
+    with _coastline_cache_lock:
+        if key not in _coastline_cache:
+            _coastline_cache[key] = (uni, nbytes)
+            _coastline_cache_stats['nbytes'] += nbytes
+        while _coastline_cache_stats['nbytes'] > COASTLINE_CACHE_MAXBYTES:
+            _, (_, evicted_nbytes) = _coastline_cache.popitem(last=False)
+            _coastline_cache_stats['nbytes'] -= evicted_nbytes
+
+    return uni
+
+
+def _contains(outer_key, inner_key):
+    source, level, lat0, lat1, lon0, lon1 = inner_key
+    return (
+        outer_key[:2] == (source, level)
+        and outer_key[2] <= lat0 and lat1 <= outer_key[3]
+        and outer_key[4] <= lon0 and lon1 <= outer_key[5]
+    )
+
+
+def coastline_cache_info():
     """
-    data = cached_resource(source)  # Download data
-    with clip_layer(data, latlim, lonlim) as clip_data:  # Clip data to area
-        return merged_areas(clip_data)  # Merge disjoint land areas
+    Return statistics of the in-memory coastline cache.
+
+    :return: A dict with keys 'hits', 'misses', 'size', 'nbytes' and
+    'maxbytes'. A request served by clipping a larger cached area counts as
+    a hit.
+    """
+    with _coastline_cache_lock:
+        info = dict(_coastline_cache_stats)
+        info['size'] = len(_coastline_cache)
+    info['maxbytes'] = COASTLINE_CACHE_MAXBYTES
+    return info
+
+
+def clear_coastline_cache():
+    """Remove all entries from the in-memory coastline cache"""
+    with _coastline_cache_lock:
+        _coastline_cache.clear()
+        _coastline_cache_stats.update(hits=0, misses=0, nbytes=0)
@@ -1,4 +1,7 @@
 from osgeo.osr import SpatialReference, CoordinateTransformation
+import collections
+import functools
+import threading
 import numpy as np
 import xarray as xr
 
@@ -25,6 +28,59 @@ EPSG_CODES = dict(
 )
 
 
+# Maximal number of SpatialReference objects kept by each constructor
+CRS_CACHE_SIZE = 128
+
+# Number of points transformed at a time by crs_transform
+CHUNK_SIZE = 65536
+
+# Maximal number of CoordinateTransformation objects kept by each thread
+TRANSFORM_CACHE_SIZE = 32
+
+_transform_cache = threading.local()
+_transform_cache_lock = threading.Lock()
+_transform_cache_stats = dict(hits=0, misses=0)
+
+# Worker threads are kept between calls, so that the transformation objects
+# in their thread-local caches can be reused
+_thread_pool = None
+_thread_pool_size = 0
+_thread_pool_lock = threading.Lock()
+
+
+def _interned(func):
+    """Cache the SpatialReference objects created by ``func``
+
+    The cached objects are never handed out, since SpatialReference objects
+    are mutable. Instead, a clone of the cached object is returned, which is
+    much cheaper than parsing WKT or looking up EPSG codes. Calls with
+    unhashable arguments, such as numpy arrays, are not cached.
+    """
+    cached_func = functools.lru_cache(maxsize=CRS_CACHE_SIZE)(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return cached_func(*args, **kwargs).Clone()
+        except TypeError:
+            if _is_hashable((args, tuple(kwargs.values()))):
+                raise
+            return func(*args, **kwargs)
+
+    wrapper.cache_info = cached_func.cache_info
+    wrapper.cache_clear = cached_func.cache_clear
+    return wrapper
+
+
+def _is_hashable(obj):
+    try:
+        hash(obj)
+    except TypeError:
+        return False
+    return True
+
+
+@_interned
 def crs_from_wkt(wkt):
     """Create SpatialReference from Well Known Text (WKT)
 
@@ -44,17 +100,26 @@ def crs_from_epsg(epsg):
     """Create SpatialReference from EPSG code
 
     :param epsg:
-        EPSG code representing of the spatial reference frame
-    :type epsg: int
+        EPSG code representing of the spatial reference frame, or one of the
+        names in ``EPSG_CODES``
+    :type epsg: int | str
     :returns:
         SpatialReference object
     :rtype: SpatialReference
     """
+    if isinstance(epsg, str):
+        epsg = EPSG_CODES[epsg.lower()]
+    return _crs_from_epsg(int(epsg))
+
+
+@_interned
+def _crs_from_epsg(epsg):
     proj = SpatialReference()
     proj.ImportFromEPSG(epsg)
     return proj
 
 
+@_interned
 def crs_from_proj4str(proj4str):
     """Create SpatialReference from PROJ4 string
 
@@ -82,6 +147,11 @@ def crs_local(lon, lat):
         SpatialReference object
     :rtype: SpatialReference
     """
+    return _crs_local(float(lon), float(lat))
+
+
+@_interned
+def _crs_local(lon, lat):
     wkt = f"""
         PROJCS["Local ETRS89",
             GEOGCS["ETRS89",
@@ -111,6 +181,7 @@ def crs_local(lon, lat):
     return sr
 
 
+@_interned
 def crs_nf160(named_area, metric_unit=False):
     """Create coordinate system based on the NorFjords160 (NF160) grid
 
@@ -143,6 +214,7 @@ def crs_nf160(named_area, metric_unit=False):
     return _nor_roms(*params[named_area], metric_unit=metric_unit)
 
 
+@_interned
 def crs_nk800(metric_unit=False):
     """Create coordinate system based on the NorKyst800 (NK800) grid
 
@@ -157,12 +229,28 @@ def crs_nk800(metric_unit=False):
     return _nor_roms(metric_unit=metric_unit)
 
 
-def crs_transform(x, y, from_crs, to_crs):
+def crs_transform(x, y, from_crs, to_crs, out=None, chunksize=None,
+                  workers=None):
     """Transform coordinate values between two coordinate systems
 
     Transform coordinate values between two coordinate systems. The shape
     of the input arrays are preserved.
 
+    Transformations between a north polar stereographic grid (such as
+    NorKyst800 or NorFjords160) and geographic coordinates, or between two
+    such grids sharing the same projection, are computed by closed-form
+    expressions in numpy. All other transformations are done by GDAL.
+
+    The points are transformed in chunks of fixed size, so that the memory
+    use in addition to the input and output arrays is bounded. The output
+    arrays may be supplied by the caller, and may be the input arrays
+    themselves for an in-place transformation. If ``workers`` is given, the
+    chunks are distributed over a pool of threads, each thread using its own
+    CoordinateTransformation object.
+
+    Dask arrays are transformed lazily, block by block, and the result is
+    returned as dask arrays. In this case, ``out`` is not supported.
+
     :param x:
         First coordinate array
     :type: numpy.ndarray
@@ -175,82 +263,358 @@ def crs_transform(x, y, from_crs, to_crs):
     :param to_crs:
         Transformed coordinates reference frame
     :type to_crs: osgeo.osr.SpatialReference
+    :param out:
+        Optional (xp, yp) tuple of float arrays, with the same shape as the
+        input, where the result is stored
+    :type out: (numpy.ndarray, numpy.ndarray)
+    :param chunksize:
+        Number of points transformed at a time. Default is ``CHUNK_SIZE``.
+    :type chunksize: int
+    :param workers:
+        Number of worker threads. Default is to use the calling thread only.
+    :type workers: int
     :returns:
         (xp, yp), the transformed coordinates
     :rtype: (numpy.ndarray, numpy.ndarray)
     """
 
-    xarr = np.array(x)
-    yarr = np.array(y)
+    if _is_dask_array(x) or _is_dask_array(y):
+        if out is not None:
+            raise ValueError('Output arrays are not supported for dask input')
+        return _crs_transform_lazy(x, y, from_crs, to_crs, chunksize)
+
+    xarr = np.asarray(x)
+    yarr = np.asarray(y)
 
     if len(xarr) == 0 and len(yarr) == 0:
+        if out is not None:
+            return out
         return np.array([x, y])
 
-    ct = CoordinateTransformation(from_crs, to_crs)
-
-    xrv = xarr.ravel()
-    yrv = yarr.ravel()
-    points = np.stack([xrv, yrv, np.zeros_like(xrv)]).T
-    result = np.array(ct.TransformPoints(points))
-    xp = result[:, 0].reshape(xarr.shape)
-    yp = result[:, 1].reshape(yarr.shape)
+    if xarr.shape != yarr.shape:
+        raise ValueError(
+            f'Shape mismatch: x has shape {xarr.shape}, y has {yarr.shape}')
+
+    if out is None:
+        out = (np.empty(xarr.shape), np.empty(yarr.shape))
+    xp, yp = out
+    if xp.shape != xarr.shape or yp.shape != yarr.shape:
+        raise ValueError('Output arrays must have the same shape as input')
+
+    transform_chunk = _fast_transformer(from_crs, to_crs)
+    if transform_chunk is None:
+        # Each thread needs a separate transformation object, which is
+        # retrieved from the thread-local cache
+        transform_chunk = functools.partial(
+            _gdal_transform, from_crs=from_crs, to_crs=to_crs,
+            key=(_crs_key(from_crs), _crs_key(to_crs)))
+
+    def transform_range(start, stop):
+        xc, yc = transform_chunk(xarr.flat[start:stop], yarr.flat[start:stop])
+        xp.flat[start:stop] = xc
+        yp.flat[start:stop] = yc
+
+    chunksize = chunksize or CHUNK_SIZE
+    ranges = [(i, i + chunksize) for i in range(0, xarr.size, chunksize)]
+
+    _parallel_map(lambda r: transform_range(*r), ranges, workers)
     return xp, yp
 
 
+def crs_transform_many(x, y, from_crs, to_crs_list, chunksize=None,
+                       workers=None):
+    """Transform coordinate values into several coordinate systems
+
+    The input is converted once to a float array which is shared by all the
+    transformations, and the results are written into a single preallocated
+    output array.
+
+    :param x:
+        First coordinate array
+    :type: numpy.ndarray
+    :param y:
+        Second coordinate array
+    :type: numpy.ndarray
+    :param from_crs:
+        Source coordinates reference frame
+    :type from_crs: osgeo.osr.SpatialReference
+    :param to_crs_list:
+        Transformed coordinates reference frames
+    :type to_crs_list: list[osgeo.osr.SpatialReference]
+    :param chunksize:
+        Number of points transformed at a time. Default is ``CHUNK_SIZE``.
+    :type chunksize: int
+    :param workers:
+        Number of worker threads. If given, the target coordinate systems
+        are processed in parallel.
+    :type workers: int
+    :returns:
+        A list of (xp, yp) tuples, one for each target coordinate system
+    :rtype: list[(numpy.ndarray, numpy.ndarray)]
+    """
+    xarr = np.ascontiguousarray(x, dtype=float)
+    yarr = np.ascontiguousarray(y, dtype=float)
+    if xarr.shape != yarr.shape:
+        raise ValueError(
+            f'Shape mismatch: x has shape {xarr.shape}, y has {yarr.shape}')
+
+    out = np.empty((len(to_crs_list), 2) + xarr.shape)
+    results = [(out[k, 0], out[k, 1]) for k in range(len(to_crs_list))]
+    if xarr.size == 0:
+        return results
+
+    def transform_one(k):
+        crs_transform(xarr, yarr, from_crs, to_crs_list[k], out=results[k],
+                      chunksize=chunksize)
+
+    _parallel_map(transform_one, range(len(to_crs_list)), workers)
+    return results
+
+
+def _parallel_map(func, items, workers=None):
+    """Call ``func`` on each item, using up to ``workers`` threads
+
+    The calling thread takes part in the work, and the remaining threads are
+    taken from a persistent pool shared by all calls. Since the pool threads
+    are not restarted, their thread-local transformation caches stay warm
+    from one call to the next. If the pool is busy, for instance when called
+    from a pool thread, the calling thread processes the remaining items
+    itself.
+    """
+    items = list(items)
+    if workers is None or workers <= 1 or len(items) <= 1:
+        for item in items:
+            func(item)
+        return
+
+    remaining = iter(items)
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def work():
+        while not failed.is_set():
+            with lock:
+                item = next(remaining, remaining)
+            if item is remaining:
+                return
+            try:
+                func(item)
+            except BaseException:
+                failed.set()
+                raise
+
+    num_helpers = min(workers, len(items)) - 1
+    pool = _get_thread_pool(num_helpers)
+    helpers = [pool.submit(work) for _ in range(num_helpers)]
+    try:
+        work()
+    finally:
+        for future in helpers:
+            future.cancel()
+    for future in helpers:
+        if not future.cancelled():
+            future.result()
+
+
+def _get_thread_pool(size):
+    """Return the shared thread pool, enlarged to at least ``size`` threads
+
+    A pool that is replaced by a larger one is not shut down, since other
+    threads may still be submitting tasks to it. Its worker threads exit
+    when it is garbage collected.
+    """
+    global _thread_pool, _thread_pool_size
+    from concurrent.futures import ThreadPoolExecutor
+    with _thread_pool_lock:
+        if _thread_pool is None or _thread_pool_size < size:
+            _thread_pool = ThreadPoolExecutor(
+                max_workers=size, thread_name_prefix='imr-maps')
+            _thread_pool_size = size
+        return _thread_pool
+
+
+def _crs_transform_lazy(x, y, from_crs, to_crs, chunksize=None):
+    import dask.array as da
+    x = da.asarray(x)
+    y = da.asarray(y).rechunk(x.chunks)
+
+    # Pass the coordinate systems as WKT, since SpatialReference objects
+    # cannot be pickled by distributed schedulers
+    keys = (_crs_key(from_crs), _crs_key(to_crs))
+    stacked = da.map_blocks(
+        _transform_block, x, y, keys=keys, chunksize=chunksize,
+        new_axis=0, chunks=((2, ), ) + x.chunks, dtype=float,
+    )
+    return stacked[0], stacked[1]
+
+
+def _transform_block(x, y, keys, chunksize):
+    from_crs, to_crs = [_crs_from_key(k) for k in keys]
+    if x.size == 0:
+        return np.empty((2, ) + x.shape)
+    xp, yp = crs_transform(x, y, from_crs, to_crs, chunksize=chunksize)
+    return np.stack([xp, yp])
+
+
+def _is_dask_array(arr):
+    try:
+        import dask.array as da
+    except ImportError:
+        return False
+    return isinstance(arr, da.Array)
+
+
+def _gdal_transform(x, y, from_crs, to_crs, key):
+    ct = _cached_transformation(
+        key, lambda: CoordinateTransformation(from_crs, to_crs))
+    points = np.stack([x, y, np.zeros_like(x, dtype=float)]).T
+    result = np.asarray(ct.TransformPoints(points))
+    return result[:, 0], result[:, 1]
+
+
+def get_transformation(from_crs, to_crs):
+    """Return a cached CoordinateTransformation between two coordinate systems
+
+    Transformations are cached per thread, since a CoordinateTransformation
+    object can not be used by several threads at once. The cache is keyed on
+    the WKT representation and axis mapping of both coordinate systems, and
+    the least recently used transformation is discarded when the cache holds
+    more than ``TRANSFORM_CACHE_SIZE`` elements.
+
+    :param from_crs:
+        Source coordinates reference frame
+    :type from_crs: osgeo.osr.SpatialReference
+    :param to_crs:
+        Transformed coordinates reference frame
+    :type to_crs: osgeo.osr.SpatialReference
+    :returns:
+        CoordinateTransformation object
+    :rtype: osgeo.osr.CoordinateTransformation
+    """
+    key = (_crs_key(from_crs), _crs_key(to_crs))
+    return _cached_transformation(
+        key, lambda: CoordinateTransformation(from_crs, to_crs))
+
+
+def _cached_transformation(key, create):
+    cache = getattr(_transform_cache, 'transformations', None)
+    if cache is None:
+        cache = collections.OrderedDict()
+        _transform_cache.transformations = cache
+
+    ct = cache.get(key, None)
+    with _transform_cache_lock:
+        if ct is None:
+            _transform_cache_stats['misses'] += 1
+        else:
+            _transform_cache_stats['hits'] += 1
+
+    if ct is None:
+        ct = create()
+        cache[key] = ct
+        while len(cache) > TRANSFORM_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+
+    return ct
+
+
+def transform_cache_info():
+    """Return statistics of the CoordinateTransformation cache
+
+    :returns:
+        A dict with keys 'hits', 'misses', 'size' and 'maxsize', where 'size'
+        is the number of transformations cached by the current thread.
+    :rtype: dict
+    """
+    cache = getattr(_transform_cache, 'transformations', {})
+    with _transform_cache_lock:
+        info = dict(_transform_cache_stats)
+    info['size'] = len(cache)
+    info['maxsize'] = TRANSFORM_CACHE_SIZE
+    return info
+
+
+def clear_transform_cache():
+    """Clear the current thread's transformation cache and reset statistics"""
+    _transform_cache.transformations = collections.OrderedDict()
+    with _transform_cache_lock:
+        _transform_cache_stats['hits'] = 0
+        _transform_cache_stats['misses'] = 0
+
+
+def _crs_key(crs):
+    return crs.ExportToWkt(), _axis_mapping(crs)
+
+
+def _crs_from_key(key):
+    wkt, mapping = key
+    sr = crs_from_wkt(wkt)
+    try:
+        sr.SetDataAxisToSRSAxisMapping(list(mapping))
+    except AttributeError:  # GDAL < 3.0 has no axis mapping
+        pass
+    return sr
+
+
 def crs_to_gridmapping(crs):
     """Create grid_mapping variable from projection"""
-    wkt = crs.ExportToWkt()
-    dproj = xr.DataArray(
-        dims=(), data=np.int8(0),
-        attrs=dict(
-            long_name="CRS definition",
-            crs_wkt=wkt,
-            spatial_ref=wkt,
-            semi_major_axis=crs.GetSemiMajor(),
-            inverse_flattening=crs.GetInvFlattening(),
-            projected_crs_name=crs.GetAttrValue('PROJCS'),
-            geographic_crs_name=crs.GetAttrValue('GEOGCS'),
-            horizontal_datum_name=crs.GetAttrValue('DATUM'),
-            reference_ellipsoid_name=crs.GetAttrValue('SPHEROID'),
-            prime_meridian_name=crs.GetAttrValue('PRIMEM'),
-            towgs84=crs.GetTOWGS84(),
-        ),
+    attrs = _gridmapping_attrs(crs.ExportToWkt())
+    return xr.DataArray(dims=(), data=np.int8(0), attrs=dict(attrs))
+
+
+@functools.lru_cache(maxsize=CRS_CACHE_SIZE)
+def _gridmapping_attrs(wkt):
+    crs = crs_from_wkt(wkt)
+    attrs = dict(
+        long_name="CRS definition",
+        crs_wkt=wkt,
+        spatial_ref=wkt,
+        semi_major_axis=crs.GetSemiMajor(),
+        inverse_flattening=crs.GetInvFlattening(),
+        projected_crs_name=crs.GetAttrValue('PROJCS'),
+        geographic_crs_name=crs.GetAttrValue('GEOGCS'),
+        horizontal_datum_name=crs.GetAttrValue('DATUM'),
+        reference_ellipsoid_name=crs.GetAttrValue('SPHEROID'),
+        prime_meridian_name=crs.GetAttrValue('PRIMEM'),
+        towgs84=crs.GetTOWGS84(),
     )
 
     proj_name = crs.GetAttrValue('PROJECTION', 0)
 
     # If WGS84 or ETRS89
     if proj_name is None:
-        dproj.attrs['grid_mapping_name'] = 'latitude_longitude'
+        attrs['grid_mapping_name'] = 'latitude_longitude'
 
     # If transverse mercator
     elif proj_name == "Transverse_Mercator":
-        dproj.attrs['grid_mapping_name'] = 'transverse_mercator'
-        dproj.attrs['scale_factor_at_central_meridian'] = crs.GetProjParm(
+        attrs['grid_mapping_name'] = 'transverse_mercator'
+        attrs['scale_factor_at_central_meridian'] = crs.GetProjParm(
             'scale_factor')
-        dproj.attrs['longitude_of_central_meridian'] = crs.GetProjParm(
+        attrs['longitude_of_central_meridian'] = crs.GetProjParm(
             'central_meridian')
-        dproj.attrs['latitude_of_projection_origin'] = crs.GetProjParm(
+        attrs['latitude_of_projection_origin'] = crs.GetProjParm(
             'latitude_of_origin')
-        dproj.attrs['false_easting'] = crs.GetProjParm('false_easting')
-        dproj.attrs['false_northing'] = crs.GetProjParm('false_northing')
+        attrs['false_easting'] = crs.GetProjParm('false_easting')
+        attrs['false_northing'] = crs.GetProjParm('false_northing')
 
     # If polar stereographic
     elif proj_name == 'Polar_Stereographic':
         lat_orig_sign = np.sign(crs.GetProjParm('latitude_of_origin'))
-        dproj.attrs['grid_mapping_name'] = 'polar_stereographic'
-        dproj.attrs['standard_parallel'] = crs.GetProjParm('latitude_of_origin')
-        dproj.attrs['straight_vertical_longitude_from_pole'] = crs.GetProjParm(
+        attrs['grid_mapping_name'] = 'polar_stereographic'
+        attrs['standard_parallel'] = crs.GetProjParm('latitude_of_origin')
+        attrs['straight_vertical_longitude_from_pole'] = crs.GetProjParm(
             'central_meridian')
-        dproj.attrs['latitude_of_projection_origin'] = lat_orig_sign * 90
-        dproj.attrs['false_easting'] = crs.GetProjParm('false_easting')
-        dproj.attrs['false_northing'] = crs.GetProjParm('false_northing')
-        dproj.attrs['longitude_of_prime_meridian'] = 0
+        attrs['latitude_of_projection_origin'] = lat_orig_sign * 90
+        attrs['false_easting'] = crs.GetProjParm('false_easting')
+        attrs['false_northing'] = crs.GetProjParm('false_northing')
+        attrs['longitude_of_prime_meridian'] = 0
 
     else:
         raise ValueError(f'Unknown projection: {proj_name}')
 
-    return dproj
+    return attrs
 
 
 def crs_from_gridmapping(grid_mapping):
@@ -258,10 +622,7 @@ def crs_from_gridmapping(grid_mapping):
     if 'crs_wkt' not in grid_mapping.attrs:
         raise NotImplementedError('At present, a "crs_wkt" attr is required')
 
-    wkt = grid_mapping.attrs['crs_wkt']
-    sr = SpatialReference()
-    sr.ImportFromWkt(wkt)
-    return sr
+    return crs_from_wkt(grid_mapping.attrs['crs_wkt'])
 
 
 def _nor_roms(xp=3991, yp=2230, dx=800, ylon=70, name='NK800', metric_unit=False):
@@ -296,6 +657,349 @@ def _nor_roms(xp=3991, yp=2230, dx=800, ylon=70, name='NK800', metric_unit=False
     return sr
 
 
+# Datums which are treated as equal by PROJ when no better transformation
+# is available
+_NULL_SHIFT_DATUMS = (
+    'WGS_1984',
+    'European_Terrestrial_Reference_System_1989',
+)
+
+
+def _fast_transformer(from_crs, to_crs):
+    """Return a numpy implementation of the transformation, or None"""
+    from_stere = _polar_stereographic_params(from_crs)
+    to_stere = _polar_stereographic_params(to_crs)
+
+    # Between grids of the same projection, the transformation is affine
+    if from_stere is not None and to_stere is not None:
+        if from_stere['ellipsoid'] != to_stere['ellipsoid']:
+            return None
+        if from_stere['projection'] != to_stere['projection']:
+            return None
+        if not _is_null_datum_shift(from_stere['datum'], to_stere['datum']):
+            return None
+        return functools.partial(
+            _shift_and_scale, from_params=from_stere, to_params=to_stere)
+
+    elif from_stere is not None:
+        to_order = _geographic_axis_order(to_crs)
+        if to_order is None:
+            return None
+        if not _is_null_datum_shift(from_stere['datum'], _datum(to_crs)):
+            return None
+        return functools.partial(
+            _stere_to_geo, params=from_stere, lonlat=to_order == 'lonlat')
+
+    elif to_stere is not None:
+        from_order = _geographic_axis_order(from_crs)
+        if from_order is None:
+            return None
+        if not _is_null_datum_shift(_datum(from_crs), to_stere['datum']):
+            return None
+        return functools.partial(
+            _geo_to_stere, params=to_stere, lonlat=from_order == 'lonlat')
+
+    return None
+
+
+def _datum(crs):
+    name = crs.GetAttrValue('DATUM') or ''
+    if name.endswith('_ensemble'):
+        name = name[:-len('_ensemble')]
+    return name
+
+
+def _is_null_datum_shift(datum_a, datum_b):
+    if datum_a == datum_b:
+        return True
+    return datum_a in _NULL_SHIFT_DATUMS and datum_b in _NULL_SHIFT_DATUMS
+
+
+def _axis_mapping(crs):
+    try:
+        return tuple(crs.GetDataAxisToSRSAxisMapping())
+    except AttributeError:  # GDAL < 3.0 always uses (east, north) order
+        return 1, 2
+
+
+def _geographic_axis_order(crs):
+    """Return 'lonlat' or 'latlon' if crs is a geographic degree system"""
+    from osgeo import osr
+    if not crs.IsGeographic() or crs.IsProjected():
+        return None
+    if abs(crs.GetAngularUnits() - np.pi / 180) > 1e-12:
+        return None
+
+    mapping = _axis_mapping(crs)
+    if sorted(mapping) != [1, 2]:
+        return None
+
+    try:
+        first_axis = crs.GetAxisOrientation(None, mapping[0] - 1)
+    except AttributeError:  # GDAL < 3.0 always uses (east, north) order
+        return 'lonlat'
+
+    if first_axis == osr.OAO_East:
+        return 'lonlat'
+    elif first_axis == osr.OAO_North:
+        return 'latlon'
+    return None
+
+
+def _polar_stereographic_params(crs):
+    """Return parameters if crs is a north polar stereographic projection
+    with latitude of true scale (variant B), or None otherwise"""
+    if not crs.IsProjected():
+        return None
+    if crs.GetAttrValue('PROJECTION') != 'Polar_Stereographic':
+        return None
+    if _axis_mapping(crs) != (1, 2):
+        return None
+
+    lat_ts = crs.GetProjParm('latitude_of_origin')
+    if not (0 < lat_ts < 90) or crs.GetProjParm('scale_factor', 1) != 1:
+        return None
+
+    return dict(
+        ellipsoid=(crs.GetSemiMajor(), crs.GetInvFlattening()),
+        projection=(lat_ts, crs.GetProjParm('central_meridian')),
+        datum=_datum(crs),
+        false_easting=crs.GetNormProjParm('false_easting'),
+        false_northing=crs.GetNormProjParm('false_northing'),
+        unit=crs.GetLinearUnits(),
+    )
+
+
+def _stere_constants(params):
+    a, invf = params['ellipsoid']
+    lat_ts, lon_0 = params['projection']
+    f = 1 / invf
+    e2 = f * (2 - f)
+    e = np.sqrt(e2)
+    phi_c = np.deg2rad(lat_ts)
+    m_c = np.cos(phi_c) / np.sqrt(1 - e2 * np.sin(phi_c) ** 2)
+    t_c = _stere_t(phi_c, e)
+    return a * m_c / t_c, e, lon_0
+
+
+def _stere_t(phi, e):
+    esin = e * np.sin(phi)
+    return np.tan(np.pi / 4 - phi / 2) / ((1 - esin) / (1 + esin)) ** (e / 2)
+
+
+def _geo_to_stere(x, y, params, lonlat=True):
+    lon, lat = (x, y) if lonlat else (y, x)
+    scale, e, lon_0 = _stere_constants(params)
+
+    rho = scale * _stere_t(np.deg2rad(lat), e)
+    dlambda = np.deg2rad(lon - lon_0)
+    unit = params['unit']
+    xp = (params['false_easting'] + rho * np.sin(dlambda)) / unit
+    yp = (params['false_northing'] - rho * np.cos(dlambda)) / unit
+    return xp, yp
+
+
+def _stere_to_geo(x, y, params, lonlat=True):
+    scale, e, lon_0 = _stere_constants(params)
+
+    unit = params['unit']
+    de = x * unit - params['false_easting']
+    dn = y * unit - params['false_northing']
+    t = np.hypot(de, dn) / scale
+
+    # Series expansion of the inverse conformal latitude (EPSG guidance
+    # note 7-2, section 3.2.7)
+    e2 = e * e
+    e4 = e2 * e2
+    e6 = e4 * e2
+    e8 = e4 * e4
+    chi = np.pi / 2 - 2 * np.arctan(t)
+    phi = (
+        chi
+        + (e2 / 2 + 5 * e4 / 24 + e6 / 12 + 13 * e8 / 360) * np.sin(2 * chi)
+        + (7 * e4 / 48 + 29 * e6 / 240 + 811 * e8 / 11520) * np.sin(4 * chi)
+        + (7 * e6 / 120 + 81 * e8 / 1120) * np.sin(6 * chi)
+        + (4279 * e8 / 161280) * np.sin(8 * chi)
+    )
+
+    lat = np.rad2deg(phi)
+    lon = lon_0 + np.rad2deg(np.arctan2(de, -dn))
+    lon = np.mod(lon + 180, 360) - 180
+    return (lon, lat) if lonlat else (lat, lon)
+
+
+def _shift_and_scale(x, y, from_params, to_params):
+    from_unit = from_params['unit']
+    to_unit = to_params['unit']
+    de = to_params['false_easting'] - from_params['false_easting']
+    dn = to_params['false_northing'] - from_params['false_northing']
+    xp = (x * from_unit + de) / to_unit
+    yp = (y * from_unit + dn) / to_unit
+    return xp, yp
+
+
+class GridIndex:
+    """Spatial index for locating geographic positions on a 2-D grid
+
+    The index is built once from the longitude and latitude of the grid
+    cell centers, which may be curvilinear, and can be reused for any number
+    of queries. Grid cells can be excluded from the index using a mask.
+    The index can be stored to disk using :meth:`save` and restored using
+    :meth:`load`.
+
+    :param lon:
+        Longitude of grid cell centers, with dimensions (y, x)
+    :type lon: numpy.ndarray
+    :param lat:
+        Latitude of grid cell centers, with dimensions (y, x)
+    :type lat: numpy.ndarray
+    :param mask:
+        Optional boolean array, where False marks grid cells that are
+        excluded from the index. At least one cell must be included.
+    :type mask: numpy.ndarray
+    """
+
+    def __init__(self, lon, lat, mask=None):
+        from scipy.spatial import cKDTree
+
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        if lon.ndim != 2 or lon.shape != lat.shape:
+            raise ValueError('lon and lat must be 2-D arrays of equal shape')
+        if min(lon.shape) < 2:
+            raise ValueError('The grid must have at least 2 x 2 cells')
+
+        self.shape = lon.shape
+        self._points = _unit_sphere(lon, lat)
+
+        if mask is None:
+            self._cells = np.arange(lon.size)
+        else:
+            self._cells = np.flatnonzero(np.asarray(mask, dtype=bool))
+            if self._cells.size == 0:
+                raise ValueError('The mask excludes every grid cell')
+        self._tree = cKDTree(self._points.reshape((-1, 3))[self._cells])
+
+    @classmethod
+    def from_dataset(cls, dset, lon=None, lat=None, coords=None,
+                     grid_mapping=None, mask=None):
+        """Build index from dataset
+
+        The grid is defined either by the names of 2-D longitude and latitude
+        variables, or by the names of the projected coordinates and the
+        grid_mapping variable.
+
+        :param dset: Dataset containing the grid
+        :param lon: Name of longitude variable
+        :param lat: Name of latitude variable
+        :param coords: Names of (x, y) coordinates, if lon/lat is not given
+        :param grid_mapping: Name of grid_mapping variable, or a
+            SpatialReference object
+        :param mask: Name of mask variable, or a boolean array
+        :returns: A new GridIndex object
+        """
+        if lon is not None and lat is not None:
+            lon_values = dset.variables[lon].values
+            lat_values = dset.variables[lat].values
+        else:
+            x = dset.variables[coords[0]].values
+            y = dset.variables[coords[1]].values
+            if x.ndim == 1 and y.ndim == 1:
+                x, y = np.meshgrid(x, y)
+            _, grid_crs = _load_crs(dset, grid_mapping)
+            lon_values, lat_values = crs_transform(
+                x, y, grid_crs, crs_from_epsg(EPSG_CODES['wgs84']))
+
+        if isinstance(mask, str):
+            mask = dset.variables[mask].values
+
+        return cls(lon_values, lat_values, mask)
+
+    def query(self, lon, lat):
+        """Find fractional grid indices of geographic positions
+
+        The nearest grid cell is found using the index, and the fractional
+        offset from its center is found by linearizing the grid around the
+        cell. Positions outside the grid, more than one cell away from the
+        nearest unmasked cell, or with non-finite coordinates, are assigned
+        NaN.
+
+        :param lon: Longitude of the positions
+        :param lat: Latitude of the positions
+        :returns: (i, j), the fractional indices along the x and y dimension.
+            Cell centers have integer indices.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        finite = np.isfinite(lon.ravel()) & np.isfinite(lat.ravel())
+        positions = _unit_sphere(lon.ravel()[finite], lat.ravel()[finite])
+
+        # Find nearest cell center
+        _, nearest = self._tree.query(positions)
+        ny, nx = self.shape
+        j, i = np.unravel_index(self._cells[nearest], self.shape)
+
+        # Local derivatives of the grid, using central differences where
+        # possible and one-sided differences at the boundaries
+        ip, im = np.minimum(i + 1, nx - 1), np.maximum(i - 1, 0)
+        jp, jm = np.minimum(j + 1, ny - 1), np.maximum(j - 1, 0)
+        pts = self._points
+        di = (pts[j, ip] - pts[j, im]) / (ip - im)[:, np.newaxis]
+        dj = (pts[jp, i] - pts[jm, i]) / (jp - jm)[:, np.newaxis]
+
+        # Solve the normal equations of the linearized problem
+        d = positions - pts[j, i]
+        a11 = np.sum(di * di, axis=1)
+        a12 = np.sum(di * dj, axis=1)
+        a22 = np.sum(dj * dj, axis=1)
+        b1 = np.sum(di * d, axis=1)
+        b2 = np.sum(dj * d, axis=1)
+        det = a11 * a22 - a12 * a12
+        di_frac = (a22 * b1 - a12 * b2) / det
+        dj_frac = (a11 * b2 - a12 * b1) / det
+
+        i_frac = i + di_frac
+        j_frac = j + dj_frac
+        invalid = (
+            (np.maximum(np.abs(di_frac), np.abs(dj_frac)) > 1)
+            | (i_frac < -0.5) | (i_frac > nx - 0.5)
+            | (j_frac < -0.5) | (j_frac > ny - 0.5)
+        )
+        i_frac[invalid] = np.nan
+        j_frac[invalid] = np.nan
+
+        i_out = np.full(lon.size, np.nan)
+        j_out = np.full(lat.size, np.nan)
+        i_out[finite] = i_frac
+        j_out[finite] = j_frac
+        return i_out.reshape(lon.shape), j_out.reshape(lat.shape)
+
+    def save(self, fname):
+        """Store index to disk"""
+        import pickle
+        with open(fname, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(fname):
+        """Load index previously stored by :meth:`save`"""
+        import pickle
+        with open(fname, 'rb') as f:
+            return pickle.load(f)
+
+
+def _unit_sphere(lon, lat):
+    lon_rad = np.deg2rad(lon)
+    lat_rad = np.deg2rad(lat)
+    cos_lat = np.cos(lat_rad)
+    return np.stack([
+        cos_lat * np.cos(lon_rad),
+        cos_lat * np.sin(lon_rad),
+        np.sin(lat_rad),
+    ], axis=-1)
+
+
 def set_crs(dset: xr.Dataset, crs, coords=None, data_vars=None):
     grid_mapping, _ = _load_crs(dset, crs)
     dset = dset.assign({grid_mapping.name: grid_mapping})
@@ -327,14 +1031,13 @@ def _load_crs(dset, gridmapping_or_crs):
     return grid_mapping, crs
 
 
-def change_crs(dset: xr.Dataset, old_coords, old_crs, new_coords, new_crs):
+def change_crs(dset: xr.Dataset, old_coords, old_crs, new_coords, new_crs,
+               workers=None):
     dset = dset.copy()
 
-    # Load coordinates
-    old_x = dset.variables[old_coords[0]].values
-    old_y = dset.variables[old_coords[1]].values
-    if len(old_x.shape) == 1 and len(old_y.shape) == 1:
-        old_x, old_y = np.meshgrid(old_x, old_y)
+    # Load coordinates. Dask arrays are kept lazy.
+    old_x = dset.variables[old_coords[0]].data
+    old_y = dset.variables[old_coords[1]].data
 
     # Find old dimensions
     xdims = dset.variables[old_coords[0]].dims
@@ -344,24 +1047,44 @@ def change_crs(dset: xr.Dataset, old_coords, old_crs, new_coords, new_crs):
     else:
         dims = ydims + xdims
 
-    # Transform coordinates
+    # Transform coordinates. If the transformation preserves the axes, only
+    # the one-dimensional coordinate vectors need to be transformed.
     old_gridmap, old_proj = _load_crs(dset, old_crs)
     new_gridmap, new_proj = _load_crs(dset, new_crs)
-    new_x, new_y = crs_transform(old_x, old_y, old_proj, new_proj)
+    separable_transform = None
+    if len(old_x.shape) == 1 and len(old_y.shape) == 1:
+        separable_transform = _separable_transformer(old_proj, new_proj)
+        if separable_transform is None:
+            old_x, old_y = np.meshgrid(old_x, old_y)
+
+    if separable_transform is not None:
+        new_x, new_y = separable_transform(old_x, old_y)
+        is_1d = True
+    else:
+        new_x, new_y = crs_transform(
+            old_x, old_y, old_proj, new_proj, workers=workers)
+
+        # Check if new coordinates are one-dimensional
+        xdiff = _max_abs_diff(new_x, axis=0)
+        ydiff = _max_abs_diff(new_y, axis=1)
+        if _is_dask_array(xdiff):
+            import dask
+            xdiff, ydiff = dask.compute(xdiff, ydiff)
+        is_1d = xdiff < 1e-8 and ydiff < 1e-8
+        if is_1d:
+            new_x = new_x[0, :]
+            new_y = new_y[:, 0]
 
     # Remove old grid mapping and coordinates
     dset = dset.drop_vars(old_gridmap.name)
     dset = dset.drop_vars(old_coords)
 
-    # Check if new coordinates are one-dimensional
-    xdiff = np.max(np.abs(np.diff(new_x, axis=0)))
-    ydiff = np.max(np.abs(np.diff(new_y, axis=1)))
-    if xdiff < 1e-8 and ydiff < 1e-8:
+    if is_1d:
         # If one-dimensional, store as one-dimensional variables and
         # change dimension names to match coordinates
         dset = dset.assign_coords({
-            new_coords[0]: xr.Variable(dims[1], new_x[0, :]),
-            new_coords[1]: xr.Variable(dims[0], new_y[:, 0]),
+            new_coords[0]: xr.Variable(dims[1], new_x),
+            new_coords[1]: xr.Variable(dims[0], new_y),
         })  # type: xr.Dataset
         dset = dset.swap_dims(dict(zip(reversed(dims), new_coords)))
     else:
@@ -383,6 +1106,71 @@ def change_crs(dset: xr.Dataset, old_coords, old_crs, new_coords, new_crs):
     return dset
 
 
+def _max_abs_diff(arr, axis):
+    """Maximal difference between neighbouring elements along an axis,
+    computed in blocks to avoid full-size temporary arrays. The result is NaN
+    if any difference is NaN, for instance when the array contains points
+    which could not be transformed."""
+    if _is_dask_array(arr):
+        return np.max(np.abs(np.diff(arr, axis=axis)))
+
+    arr = np.moveaxis(arr, axis, 0)
+    rows_per_block = max(1, CHUNK_SIZE // max(1, arr[0].size))
+    result = 0
+    for start in range(0, arr.shape[0] - 1, rows_per_block):
+        block = arr[start:start + rows_per_block + 1]
+        result = np.maximum(result, np.max(np.abs(np.diff(block, axis=0))))
+    return result
+
+
+def _separable_transformer(from_crs, to_crs):
+    """Return a transformation where the first coordinate depends only on
+    the first input coordinate, and the second coordinate only on the
+    second input coordinate. Return None if no such transformation is
+    known."""
+    if _axis_mapping(from_crs) != _axis_mapping(to_crs):
+        return None
+
+    if from_crs.IsSame(to_crs, ['CRITERION=EQUIVALENT']):
+        return _identity_transform
+
+    # Projections differing only in unit and false easting/northing
+    if not (from_crs.IsProjected() and to_crs.IsProjected()):
+        return None
+    if _axis_mapping(from_crs) != (1, 2):
+        return None
+    if not _projection_core(from_crs).IsSame(
+            _projection_core(to_crs), ['CRITERION=EQUIVALENT']):
+        return None
+    return functools.partial(
+        _shift_and_scale,
+        from_params=_linear_frame(from_crs),
+        to_params=_linear_frame(to_crs),
+    )
+
+
+def _projection_core(crs):
+    """Copy of a projected crs with metric unit and no false origin"""
+    core = crs.Clone()
+    core.SetLinearUnitsAndUpdateParameters('metre', 1.0)
+    core.SetNormProjParm('false_easting', 0)
+    core.SetNormProjParm('false_northing', 0)
+    core.SetProjCS('core')
+    return core
+
+
+def _linear_frame(crs):
+    return dict(
+        false_easting=crs.GetNormProjParm('false_easting'),
+        false_northing=crs.GetNormProjParm('false_northing'),
+        unit=crs.GetLinearUnits(),
+    )
+
+
+def _identity_transform(x, y):
+    return x, y
+
+
 def _add_geoattrs_to_coords(dset, grid_mapping, coords):
     grid_mapping_name = grid_mapping.attrs['grid_mapping_name']
     dset = dset.copy()
@@ -1,15 +1,26 @@
-def locations(reload=False, expires=None):
-    from imr.maps.wfs import resource
+def locations(reload=False, expires=None, incremental=False):
+    from imr.maps.wfs import resource, update
     import xarray as xr
-    fname = resource('layer_262', 'fiskdir', reload, expires)
+    if incremental:
+        # The incremental update replaces the full download, and the
+        # options of the full download do not apply
+        if reload or expires is not None:
+            raise ValueError('reload and expires cannot be combined with incremental')
+        fname = update('layer_262', 'fiskdir', key='loknr')
+    else:
+        fname = resource('layer_262', 'fiskdir', reload, expires,
+                         fingerprint=['loknr', 'navn', 'lat', 'lon'])
     dset = xr.open_dataset(fname)
     return dset.assign_coords(record=dset.loknr.values)
 
 
 def areas(reload=False, expires=None):
+    # No incremental option: The polygons are stored as CF node arrays, which
+    # cannot be merged record by record (see wfs.update)
     from imr.maps.wfs import resource
     import xarray as xr
-    fname = resource('layer_203', 'fiskdir', reload, expires)
+    fname = resource('layer_203', 'fiskdir', reload, expires,
+                     fingerprint=['lokalitet', 'navn'])
     dset = xr.open_dataset(fname)
     loknr = [int(n.decode('utf8').split(' ')[0]) for n in dset.lokalitet.values]
     dset = dset.assign(loknr=xr.Variable('record', loknr))
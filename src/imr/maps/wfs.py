@@ -1,3 +1,7 @@
+import contextlib
+import threading
+
+
 servers = {
     'fiskdir': 'https://gis.fiskeridir.no/server/services/FiskeridirWFS/MapServer/WFSServer',
     'imr_fisk': 'https://kart.hi.no/data/ows',
@@ -42,47 +46,661 @@ def writable_location():
     return os.path.join(writable_dir, 'imr_maps')
 
 
-def download_wfs_layer(layer, url, outfile):
-    import subprocess
+# Output formats supported by `download_wfs_layer`, with the file name suffix
+# used in the cache. The names are GDAL driver names.
+FORMATS = {
+    'netCDF': '',
+    'Parquet': '.parquet',
+    'Arrow': '.arrow',
+}
+
+
+def download_wfs_layer(layer, url, outfile, where=None, select=None,
+                       fmt='netCDF', progress=None, geometry=True):
+    """
+    Download a WFS layer to a local file, using GDAL within the current
+    process. The server is queried page by page.
+
+    :param layer: Name of the WFS layer
+    :param url: Address of the WFS server
+    :param outfile: Name of the output file
+    :param where: Attribute filter selecting a subset of the features
+    :param select: Comma-separated list of fields to download. Default is
+        all fields.
+    :param fmt: Output format, one of the keys in `FORMATS`. 'Parquet' gives
+        GeoParquet and 'Arrow' gives GeoArrow IPC files, which are faster to
+        write and read than netCDF.
+    :param progress: Function which is called repeatedly with the completed
+        fraction of the download, as a number between 0 and 1
+    :param geometry: If False, only the attribute fields are written
+    """
     import logging
-    logging.getLogger(__name__).info(f'Downloading {layer} from {url}')
-    cmd = ['ogr2ogr', '-f', 'netCDF', f'{outfile}', f'WFS:{url}', f'{layer}']
-    subprocess.run(cmd)
+    import math
+    from osgeo import gdal
 
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt}, must be one of {list(FORMATS)}')
 
-def resource(layer, server, recompute=False, expires=None):
-    from pathlib import Path
+    logger = logging.getLogger(__name__)
+    logger.info(f'Downloading {layer} from {url}')
+    try:
+        wfs_ds = get_wfs(url)
+        src_layer = wfs_ds.GetLayerByName(layer)
+        if src_layer is None:
+            raise IOError(f'No layer named {layer} at {url}')
 
-    def get_key(*strs):
-        from hashlib import sha256
-        hasher = sha256()
-        hasher.update("".join(strs).encode('utf-8'))
-        return hasher.digest().hex()
+        if where is not None:
+            src_layer.SetAttributeFilter(where)
+        num_features = src_layer.GetFeatureCount()
+        page_size = int(gdal.GetConfigOption('OGR_WFS_PAGE_SIZE') or 0)
+        if num_features >= 0 and page_size > 0:
+            num_pages = max(1, math.ceil(num_features / page_size))
+            logger.info(f'{num_features} features in {num_pages} pages')
 
-    key = get_key(server, layer)
-    cachedir = Path(writable_location())
-    cachedir.mkdir(parents=True, exist_ok=True)
+        reported = [-1]
+
+        def callback(complete, message, user_data):
+            percent = int(complete * 100)
+            if percent // 10 > reported[0] // 10:
+                logger.info(f'Downloading {layer}: {percent} %')
+                reported[0] = percent
+            if progress is not None:
+                progress(complete)
+            return 1
+
+        options = gdal.VectorTranslateOptions(
+            format=fmt,
+            layers=[layer],
+            where=where,
+            selectFields=None if select is None else select.split(','),
+            geometryType=None if geometry else 'NONE',
+            callback=callback,
+        )
+        out_ds = gdal.VectorTranslate(str(outfile), wfs_ds, options=options)
+        if out_ds is None:
+            raise IOError(f'Unable to download {layer} from {url}')
+        out_ds = None  # Flush and close the output file
+
+    except RuntimeError as e:
+        raise IOError(f'Unable to download {layer} from {url}: {e}') from e
+
+
+def fetch_pages(layer, url, page_size=1000, workers=4, sort_by=None,
+                output_format='application/json', timeout=60):
+    """
+    Fetch all features of a WFS layer as a sequence of pages, where the
+    pages are requested concurrently.
+
+    The number of features is requested first (resultType=hits), and the
+    pages are then requested with startIndex and count, using a bounded pool
+    of threads. WFS 2.0 is required. Servers may limit the number of features
+    per response to less than the requested page size, so the number of
+    features in each page is checked, and an error is raised if a page is
+    incomplete.
+
+    :param layer: Name of the WFS layer
+    :param url: Address of the WFS server
+    :param page_size: Number of features per page
+    :param workers: Maximal number of concurrent requests
+    :param sort_by: Field used for sorting the features, which ensures that
+        the pages are consistent on servers without a natural order
+    :param output_format: Output format requested from the server. Must be
+        a GeoJSON format, but the accepted name differs between servers.
+    :param timeout: Timeout of each request, in seconds
+    :return: A list of page contents (bytes), in the order of the features
+    """
+    import json
+    import logging
+    import math
+    import urllib.parse
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+
+    num_features = server_metadata(layer, url, timeout)['number_matched']
+    if num_features is None:
+        raise IOError(f'Unable to get the number of features of {layer} from {url}')
+    num_pages = max(1, math.ceil(num_features / page_size))
+    logging.getLogger(__name__).info(
+        f'Downloading {layer} from {url}: {num_features} features in '
+        f'{num_pages} pages')
+
+    def fetch(page):
+        params = dict(
+            service='WFS', version='2.0.0', request='GetFeature',
+            typeNames=layer, startIndex=page * page_size, count=page_size,
+            outputFormat=output_format,
+        )
+        if sort_by is not None:
+            params['sortBy'] = sort_by
+        separator = '&' if '?' in url else '?'
+        page_url = url + separator + urllib.parse.urlencode(params)
+        with urllib.request.urlopen(page_url, timeout=timeout) as r:
+            body = r.read()
+
+        expected = min(page_size, num_features - page * page_size)
+        try:
+            returned = len(json.loads(body).get('features', []))
+        except (ValueError, AttributeError) as e:
+            raise IOError(f'Unable to read page {page} of {layer} from {url}: {e}') from e
+        if returned != expected:
+            raise IOError(
+                f'Page {page} of {layer} from {url} has {returned} features, '
+                f'expected {expected}. The server may limit the page size.')
+        return body
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetch, range(num_pages)))
+
+
+def download_wfs_layer_paged(layer, url, outfile, sort_by, fmt='netCDF',
+                             page_size=1000, workers=4,
+                             output_format='application/json'):
+    """
+    Download a WFS layer to a local file, fetching the pages concurrently.
+    See :func:`fetch_pages` and :func:`download_wfs_layer`.
+
+    The pages are requested as GeoJSON, and the features of all pages are
+    combined into a single feature collection before the field types are
+    determined, so that all pages share the same schema.
+
+    :param layer: Name of the WFS layer
+    :param url: Address of the WFS server
+    :param outfile: Name of the output file
+    :param sort_by: Field used for sorting the features, which is required
+        for consistent paging
+    :param fmt: Output format, one of the keys in `FORMATS`
+    :param page_size: Number of features per page
+    :param workers: Maximal number of concurrent requests
+    :param output_format: GeoJSON output format requested from the server
+    """
+    import json
+    from uuid import uuid4
+    from osgeo import gdal, ogr
+
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt}, must be one of {list(FORMATS)}')
+    if sort_by is None:
+        raise ValueError('A sort field is required for paged downloads')
+
+    pages = fetch_pages(layer, url, page_size, workers, sort_by, output_format)
+
+    # Combine the features of all pages into a single feature collection
+    try:
+        collections = [json.loads(page) for page in pages]
+        features = [f for c in collections for f in c.get('features', [])]
+    except (ValueError, AttributeError) as e:
+        raise IOError(f'Unable to read pages of {layer} from {url}: {e}') from e
+    combined = dict(collections[0], features=features)
+    combined.pop('numberReturned', None)
+
+    gdal.UseExceptions()
+    fname = f'/vsimem/{uuid4().hex}.json'
+    gdal.FileFromMemBuffer(fname, json.dumps(combined).encode('utf-8'))
+    try:
+        src_ds = ogr.Open(fname)
+        if src_ds is None:
+            raise IOError(f'Unable to read pages of {layer} from {url}')
+        options = gdal.VectorTranslateOptions(
+            format=fmt, layerName=layer.split(':')[-1])
+        out_ds = gdal.VectorTranslate(str(outfile), src_ds, options=options)
+        if out_ds is None:
+            raise IOError(f'Unable to write {layer} to {outfile}')
+        out_ds = None  # Flush and close the output file
+        src_ds = None
+    except RuntimeError as e:
+        raise IOError(f'Unable to write {layer} to {outfile}: {e}') from e
+    finally:
+        gdal.Unlink(fname)
+
+
+def resource(layer, server, recompute=False, expires=None, fmt='netCDF',
+             workers=None, sort_by=None, fingerprint=None,
+             output_format='application/json'):
+    """
+    Return a local copy of a WFS layer, downloading it if necessary.
+
+    The download is written to a temporary file which is renamed into place
+    when finished, so that readers never see a partially written file.
+    Concurrent calls for the same resource, from threads or from other
+    processes, are serialized by a lock. A caller which has waited for
+    another caller to download the resource reuses the result instead of
+    downloading again.
+
+    Server metadata (feature count and HTTP validators) are stored in a
+    sidecar file next to the local copy. When the local copy has expired,
+    the metadata are checked first, and the layer is downloaded again only
+    if the metadata have changed. The metadata include a hash of the
+    `fingerprint` fields of all features (see :func:`server_metadata`). If
+    `fingerprint` is not given, and the server does not report an ETag or
+    Last-Modified header, the layer is always downloaded again on expiry.
+    The sidecar file also records the format of the local copy.
+
+    :param layer: Name of the WFS layer
+    :param server: Name of the server, one of the keys in `servers`
+    :param recompute: If True, always download the resource
+    :param expires: Maximal age, in seconds, of the local copy
+    :param fmt: File format of the local copy, one of the keys in `FORMATS`
+    :param workers: If given, the layer is downloaded using this number of
+        concurrent page requests (see :func:`download_wfs_layer_paged`)
+    :param sort_by: Field used for sorting the features when `workers` is
+        given. Required for paged downloads.
+    :param fingerprint: List of fields, such as the key field and a
+        last-modified field, used for detecting changes on expiry
+    :param output_format: GeoJSON output format requested from the server
+        when `workers` is given
+    :return: Path of the local copy
+    """
+    import os
+    import time
+
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt}, must be one of {list(FORMATS)}')
+    if workers is not None and sort_by is None:
+        raise ValueError('A sort field is required for paged downloads')
+    cachedir, key = _cache_location(layer, server)
+    key += FORMATS[fmt]
     outfile = cachedir.joinpath(key)
+    metafile = cachedir.joinpath(key + '.json')
 
-    if recompute:
-        do_download = True
-    else:
+    def need_download(waited=False):
         if not outfile.exists():
-            do_download = True
-        else:
-            if expires is None:
-                do_download = False
-            else:
-                import os
-                import time
-                elapsed = time.time() - os.path.getmtime(outfile)
-                do_download = (elapsed > expires)
+            return True
+        if _read_metadata(metafile).get('format', fmt) != fmt:
+            return True
+        # The file was replaced or revalidated while we waited for the lock
+        if waited and _file_state(outfile) != seen:
+            return False
+        if recompute:
+            return True
+        if expires is None:
+            return False
+        elapsed = time.time() - os.path.getmtime(outfile)
+        return elapsed > expires
 
-    if do_download:
-        url = servers[server]
-        download_wfs_layer(layer, url, outfile)
+    seen = _file_state(outfile)
+    if need_download():
+        with _key_lock(key), _file_lock(cachedir.joinpath(key + '.lock')):
+            if need_download(waited=True):
+                url = servers[server]
+                synced = _utcnow()
+                metadata = _try_server_metadata(layer, url, fingerprint)
+                if (not recompute and outfile.exists()
+                        and _is_unchanged(metafile, metadata)):
+                    os.utime(outfile)
+                elif _atomic_download(
+                        layer, url, outfile, fmt, workers, sort_by,
+                        output_format):
+                    _write_metadata(metafile, dict(
+                        layer=layer, server=server, format=fmt,
+                        synced=synced, **(metadata or {})))
 
     if not outfile.exists():
         raise IOError(f'Unable to download resource {layer} from {server}')
 
     return outfile
+
+
+def update(layer, server, key, date_field=None, compare=None):
+    """
+    Incrementally refresh the local copy of a WFS layer, by downloading only
+    the features which have changed since the last synchronization.
+
+    If `date_field` is given, the server is asked for the features where
+    this field is later than the time of the last synchronization, and these
+    features replace the cached features with the same key. Features deleted
+    from the server are not detected in this case, and remain in the local
+    copy until the full layer is downloaded again.
+
+    Otherwise, the attribute fields of the remote layer are downloaded
+    without geometry, and compared with the local copy, key by key. Features
+    which are new or have different attribute values are then downloaded,
+    and deleted features are removed from the local copy. Features where
+    only the geometry is modified are not detected.
+
+    If there is no local copy, or if the local copy has variables which
+    are not indexed by record (such as CF polygon node arrays), and
+    therefore cannot be merged, the full layer is downloaded.
+
+    :param layer: Name of the WFS layer
+    :param server: Name of the server, one of the keys in `servers`
+    :param key: Name of a field which uniquely identifies each feature
+    :param date_field: Name of a field containing the last update time of
+        each feature
+    :param compare: List of fields to compare when `date_field` is not
+        given. Default is all attribute fields.
+    :return: Path of the local copy
+    """
+    import xarray as xr
+
+    cachedir, cache_key = _cache_location(layer, server)
+    outfile = cachedir.joinpath(cache_key)
+    metafile = cachedir.joinpath(cache_key + '.json')
+    if not outfile.exists():
+        return resource(layer, server)
+
+    url = servers[server]
+    with _key_lock(cache_key), _file_lock(cachedir.joinpath(cache_key + '.lock')):
+        stored = _read_metadata(metafile)
+        stored.pop('fingerprint', None)  # No longer valid after the update
+        synced = _utcnow()
+        metadata = _try_server_metadata(layer, url)
+        with xr.open_dataset(outfile) as dset:
+            cached = dset.load()
+
+        merged = None
+        if _is_mergeable(cached):
+            if date_field is not None and stored.get('synced'):
+                removed = []
+                where = f"{date_field} > '{stored['synced']}'"
+            else:
+                select = None if compare is None else ','.join([key] + list(compare))
+                remote = _download_subset(
+                    layer, url, outfile, select=select, geometry=False)
+                removed, changed_keys = _changed_keys(cached, remote, key)
+                where = _in_filter(key, changed_keys) if len(changed_keys) else None
+
+            changed = None
+            if where is not None:
+                changed = _download_subset(layer, url, outfile, where=where)
+            if changed is None or _is_mergeable(changed):
+                merged = _merge_records(cached, changed, key, removed)
+
+        if merged is not None:
+            if merged is not cached:
+                _atomic_write_netcdf(merged, outfile)
+            _write_metadata(metafile, dict(
+                stored, layer=layer, server=server, synced=synced,
+                **(metadata or {})))
+
+    if merged is None:
+        return resource(layer, server, recompute=True)
+
+    return outfile
+
+
+def _is_mergeable(dset):
+    """True if all non-scalar variables are one-dimensional along 'record',
+    so that records can be added and removed independently"""
+    return all(
+        v.dims == ('record', ) for v in dset.variables.values() if v.ndim > 0)
+
+
+def _changed_keys(cached, remote, key):
+    """Compare the records of the local and remote dataset, and return the
+    keys of the removed records and of the new or modified records"""
+    import numpy as np
+
+    local_keys = cached[key].values
+    remote_keys = remote[key].values
+    removed = np.setdiff1d(local_keys, remote_keys)
+
+    # Position of each remote record in the local dataset, or -1 if new
+    index = {k: i for i, k in enumerate(local_keys.tolist())}
+    local_idx = np.array([index.get(k, -1) for k in remote_keys.tolist()],
+                         dtype=int)
+    is_changed = local_idx < 0
+    common = ~is_changed
+
+    for name, var in remote.data_vars.items():
+        if name == key or name not in cached or var.dims != ('record', ):
+            continue
+        local_values = cached[name].values[local_idx[common]]
+        remote_values = var.values[common]
+        same = local_values == remote_values
+        if var.dtype.kind == 'f':
+            same |= np.isnan(local_values) & np.isnan(remote_values)
+        is_changed[common] |= ~same
+
+    return removed, remote_keys[is_changed]
+
+
+def _download_subset(layer, url, outfile, where=None, select=None,
+                     geometry=True):
+    """Download selected features or fields of a layer into memory"""
+    from uuid import uuid4
+    import xarray as xr
+    tmpfile = outfile.parent.joinpath(outfile.name + '.' + uuid4().hex + '.tmp')
+    try:
+        download_wfs_layer(
+            layer, url, tmpfile, where=where, select=select, geometry=geometry)
+        if not tmpfile.exists():
+            raise IOError(f'Unable to download features of {layer} from {url}')
+        with xr.open_dataset(tmpfile) as dset:
+            return dset.load()
+    finally:
+        if tmpfile.exists():
+            tmpfile.unlink()
+
+
+def _merge_records(cached, changed, key, removed):
+    """Replace or append the changed records, and drop the removed records.
+    Returns the original dataset if nothing is changed."""
+    import numpy as np
+    import xarray as xr
+
+    has_changes = changed is not None and changed.sizes.get('record', 0) > 0
+    drop = np.isin(cached[key].values, removed)
+    if has_changes:
+        drop |= np.isin(cached[key].values, changed[key].values)
+    if not has_changes and not np.any(drop):
+        return cached
+
+    parts = [cached.isel(record=~drop)]
+    if has_changes:
+        parts.append(changed)
+    return xr.concat(
+        parts, dim='record', data_vars='minimal', coords='minimal',
+        compat='override')
+
+
+def _in_filter(field, values):
+    """Attribute filter selecting the features where `field` is one of
+    the given values"""
+    def literal(v):
+        if isinstance(v, bytes):
+            v = v.decode('utf-8')
+        if isinstance(v, str):
+            return "'" + v.replace("'", "''") + "'"
+        return repr(v.item() if hasattr(v, 'item') else v)
+    return f'{field} IN ({",".join(literal(v) for v in values)})'
+
+
+def _atomic_write_netcdf(dset, outfile):
+    from uuid import uuid4
+    import os
+    tmpfile = outfile.parent.joinpath(outfile.name + '.' + uuid4().hex + '.tmp')
+    try:
+        dset.to_netcdf(tmpfile)
+        os.replace(tmpfile, outfile)
+    finally:
+        if tmpfile.exists():
+            tmpfile.unlink()
+
+
+def _file_state(fname):
+    """
+    Return the inode number and modification time of a file, or None if the
+    file does not exist. A new download replaces the inode, and a
+    revalidation changes the modification time.
+    """
+    import os
+    try:
+        stat = os.stat(fname)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _cache_location(layer, server):
+    """Return the cache directory, and the cache key of a resource"""
+    from pathlib import Path
+    from hashlib import sha256
+    hasher = sha256()
+    hasher.update("".join([server, layer]).encode('utf-8'))
+    cachedir = Path(writable_location())
+    cachedir.mkdir(parents=True, exist_ok=True)
+    return cachedir, hasher.digest().hex()
+
+
+def _utcnow():
+    """Current time as an ISO 8601 string in UTC, suitable for filters"""
+    import datetime
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return now.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _atomic_download(layer, url, outfile, fmt='netCDF', workers=None,
+                     sort_by=None, output_format='application/json'):
+    """Download to a temporary file, and move into place when finished"""
+    from uuid import uuid4
+    import os
+    tmpfile = outfile.parent.joinpath(outfile.name + '.' + uuid4().hex + '.tmp')
+    try:
+        if workers is None:
+            download_wfs_layer(layer, url, tmpfile, fmt=fmt)
+        else:
+            download_wfs_layer_paged(
+                layer, url, tmpfile, sort_by, fmt=fmt, workers=workers,
+                output_format=output_format)
+        if tmpfile.exists():
+            os.replace(tmpfile, outfile)
+            return True
+        return False
+    finally:
+        if tmpfile.exists():
+            tmpfile.unlink()
+
+
+def server_metadata(layer, url, timeout=60, fingerprint=None):
+    """
+    Request cheap metadata about a WFS layer, for detecting changes without
+    downloading the layer.
+
+    Most WFS servers do not send HTTP validators (ETag, Last-Modified) with
+    GetFeature responses. A reliable change indicator is therefore obtained
+    by requesting a few fields of all features, without geometry, and
+    hashing the response. The time stamp of the response is excluded from
+    the hash.
+
+    :param layer: Name of the WFS layer
+    :param url: Address of the WFS server
+    :param timeout: Timeout of the request, in seconds
+    :param fingerprint: List of fields used for the response hash, such as
+        the key field and a last-modified field. The first field is used for
+        sorting. If None, no hash is computed.
+    :return: A dict with keys 'number_matched' (the number of features in
+    the layer), 'etag', 'last_modified' and, if requested, 'fingerprint'
+    (the response hash). Values not reported by the server are None.
+    """
+    import re
+
+    body, headers = _get_feature(
+        url, timeout, typeNames=layer, resultType='hits')
+    match = re.search(r'number(?:Matched|OfFeatures)="(\d+)"', body.decode(
+        'utf-8', errors='replace'))
+    metadata = dict(
+        number_matched=int(match.group(1)) if match else None,
+        etag=headers.get('ETag'),
+        last_modified=headers.get('Last-Modified'),
+    )
+
+    if fingerprint is not None:
+        from hashlib import sha256
+        body, _ = _get_feature(
+            url, timeout, typeNames=layer, propertyName=','.join(fingerprint),
+            sortBy=fingerprint[0])
+        body = re.sub(rb'\btimeStamp="[^"]*"', b'', body)
+        metadata['fingerprint'] = sha256(body).hexdigest()
+
+    return metadata
+
+
+def _get_feature(url, timeout, **params):
+    """Send a WFS 2.0 GetFeature request, and return the body and headers"""
+    import urllib.parse
+    import urllib.request
+    query = urllib.parse.urlencode(dict(
+        service='WFS', version='2.0.0', request='GetFeature', **params))
+    separator = '&' if '?' in url else '?'
+    with urllib.request.urlopen(url + separator + query, timeout=timeout) as r:
+        return r.read(), r.headers
+
+
+def _try_server_metadata(layer, url, fingerprint=None):
+    import logging
+    try:
+        return server_metadata(layer, url, fingerprint=fingerprint)
+    except (OSError, ValueError) as e:
+        logging.getLogger(__name__).warning(
+            f'Unable to get metadata of {layer} from {url}: {e}')
+        return None
+
+
+def _is_unchanged(metafile, metadata):
+    """True if the stored metadata are known to match the new metadata. An
+    unchanged feature count is not sufficient, since features may be modified
+    without changing the count, so a response hash or an HTTP validator is
+    required."""
+    if metadata is None:
+        return False
+    validators = ['fingerprint', 'etag', 'last_modified']
+    if all(metadata.get(k) is None for k in validators):
+        return False
+    stored = _read_metadata(metafile)
+    return bool(stored) and all(stored.get(k) == v for k, v in metadata.items())
+
+
+def _read_metadata(metafile):
+    import json
+    try:
+        with open(metafile, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_metadata(metafile, metadata):
+    import json
+    import os
+    tmpfile = metafile.parent.joinpath(metafile.name + '.tmp')
+    with open(tmpfile, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f)
+    os.replace(tmpfile, metafile)
+
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+def _key_lock(key):
+    """Return an in-process lock which is unique for the given key"""
+    with _key_locks_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+@contextlib.contextmanager
+def _file_lock(lockfile):
+    """Exclusive lock shared between processes, held while in the context"""
+    import os
+    with open(lockfile, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # Gives up after 10 seconds, so try again
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -6,6 +6,55 @@ import os
 is_travis = "TRAVIS" in os.environ and os.environ["TRAVIS"] == "true"
 
 
+@pytest.fixture()
+def fake_coast_geometry(monkeypatch):
+    from shapely.geometry import box
+    calls = []
+
+    def coast_geometry(latlim, lonlim, source, tolerance=None, store=None):
+        calls.append((latlim, lonlim, source, tolerance))
+        return coast.merged_geometry([
+            box(5, 60, 5.5, 60.5).intersection(
+                box(lonlim[0], latlim[0], lonlim[1], latlim[1])),
+        ])
+
+    monkeypatch.setattr(coast, '_coast_geometry', coast_geometry)
+    monkeypatch.setattr(
+        coast, '_tile_store', lambda source: (None, coast.PYRAMID_LEVELS))
+    coast.clear_coastline_cache()
+    yield calls
+    coast.clear_coastline_cache()
+
+
+@pytest.fixture(scope='module')
+def shapefile(tmp_path_factory):
+    from osgeo import ogr, osr
+    from shapely.geometry import box
+    fname = tmp_path_factory.mktemp('shp').joinpath('land.shp')
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    dataSource = driver.CreateDataSource(str(fname))
+    layer = dataSource.CreateLayer('land', srs, ogr.wkbPolygon)
+    for geom in [box(4.5, 59.5, 6.5, 60.5), box(10, 60, 10.5, 60.5)]:
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(geom.wkb))
+        layer.CreateFeature(feature)
+    dataSource = None
+    return fname
+
+
+@pytest.fixture(scope='module')
+def lake_and_island():
+    from shapely.geometry import box, Polygon
+    land_with_lake = Polygon(
+        box(5, 60, 6, 61).exterior.coords,
+        [box(5.2, 60.2, 5.8, 60.8).exterior.coords],
+    )
+    island_in_lake = box(5.4, 60.4, 5.6, 60.6)
+    return [land_with_lake, island_in_lake]
+
+
 class Test_coastlines:
     @pytest.mark.skipif(is_travis, reason='No access to ssh resource')
     def test_returns_nonempty_xarray(self):
@@ -45,3 +94,517 @@ class Test_coastlines:
         assert len(c.latitude)
         assert len(c.longitude)
         assert len(c.patchsize)
+
+
+class Test_merged_areas:
+    def test_merges_overlapping_polygons(self):
+        from shapely.geometry import box
+        geoms = [box(5, 60, 5.2, 60.2), box(5.1, 60.1, 5.3, 60.3)]
+        c = coast.merged_areas(geoms)
+        assert c.sizes['patch_num'] == 1
+        assert c.patchsize.values.tolist() == [9]
+
+    def test_keeps_disjoint_polygons(self):
+        from shapely.geometry import box, MultiPolygon
+        geoms = [MultiPolygon([box(5, 60, 5.1, 60.1), box(6, 60, 6.1, 60.1)])]
+        c = coast.merged_areas(geoms)
+        assert c.sizes['patch_num'] == 2
+
+    def test_accepts_shapefile_folder(self, shapefile):
+        c = coast.merged_areas(shapefile.parent)
+        assert c.sizes['patch_num'] == 2
+
+    def test_returns_valid_result_when_no_geometries(self):
+        c = coast.merged_areas([])
+        assert c.sizes['patch_num'] == 0
+        assert c.latitude.values.tolist() == []
+
+
+class Test_build_tiles:
+    def test_same_coastlines_when_tiled(self, shapefile, tmp_path):
+        tile_file = tmp_path.joinpath('tiles.gpkg')
+        coast.build_tiles(shapefile, tile_file)
+        assert tile_file.exists()
+
+        latlim = [59.8, 60.4]
+        lonlim = [4.9, 10.2]
+        c_direct = coast.merged_areas(coast.clip_layer(shapefile, latlim, lonlim))
+        c_tiled = coast.merged_areas(coast.clip_layer(tile_file, latlim, lonlim))
+        assert c_tiled.sizes['patch_num'] == c_direct.sizes['patch_num'] == 2
+
+    def test_reads_only_intersecting_tiles(self, shapefile, tmp_path):
+        from osgeo import ogr
+        tile_file = tmp_path.joinpath('tiles.gpkg')
+        coast.build_tiles(shapefile, tile_file)
+        layer = ogr.Open(str(tile_file)).GetLayer()
+        assert layer.GetFeatureCount() == 7
+        layer.SetSpatialFilterRect(5.2, 59.7, 5.4, 59.9)
+        assert layer.GetFeatureCount() == 1
+
+    def test_simplified_levels_have_fewer_vertices(self, tmp_path):
+        import numpy as np
+        import shapely
+        from osgeo import ogr, osr
+        fname = tmp_path.joinpath('land.shp')
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        dataSource = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(
+            str(fname))
+        layer = dataSource.CreateLayer('land', srs, ogr.wkbPolygon)
+        t = np.linspace(0, 2 * np.pi, 2000, endpoint=False)
+        r = 0.4 + 0.001 * np.sin(200 * t)  # Fine-scale wiggles of ~100 m
+        wiggly = shapely.Polygon(np.stack([5 + r * np.cos(t), 60 + r * np.sin(t)], 1))
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(wiggly.wkb))
+        layer.CreateFeature(feature)
+        dataSource = None
+
+        tile_file = tmp_path.joinpath('tiles.gpkg')
+        coast.build_tiles(fname, tile_file, levels=(50, 1000))
+        latlim, lonlim = [59, 61], [4, 6]
+        full = coast.merged_geometry(coast.clip_layer(
+            tile_file, latlim, lonlim, coast.tile_layer(None)))
+        coarse = coast.merged_geometry(coast.clip_layer(
+            tile_file, latlim, lonlim, coast.tile_layer(1000)))
+        assert shapely.get_num_coordinates(coarse) < 0.2 * shapely.get_num_coordinates(full)
+        assert shapely.is_valid(coarse)
+        assert abs(coarse.area - full.area) < 0.05 * full.area
+
+    @pytest.mark.parametrize('levels', [(10, ), (300, ), (2.5, 300)])
+    def test_layers_named_by_tolerance(self, tmp_path, levels):
+        import shapely
+        from osgeo import ogr, osr
+        fname = tmp_path.joinpath('land.shp')
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(4326)
+        dataSource = ogr.GetDriverByName('ESRI Shapefile').CreateDataSource(
+            str(fname))
+        layer = dataSource.CreateLayer('land', srs, ogr.wkbPolygon)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetGeometry(ogr.CreateGeometryFromWkb(
+            shapely.box(4.5, 59.5, 5.5, 60.5).wkb))
+        layer.CreateFeature(feature)
+        dataSource = None
+
+        tile_file = tmp_path.joinpath('tiles.gpkg')
+        coast.build_tiles(fname, tile_file, levels=levels)
+        assert sorted(coast._pyramid_levels(tile_file)) == sorted(levels)
+        names = ['tiles'] + [f'tiles_{t:g}m' for t in levels]
+        assert coast._has_layers(tile_file, names)
+
+
+class Test_coastlines_cache:
+    def test_reuses_result_when_same_area(self, fake_coast_geometry):
+        c1 = coast.coastlines([60, 61], [5, 6], cache=True)
+        c2 = coast.coastlines([60, 61], [5, 6], cache=True)
+        assert len(fake_coast_geometry) == 1
+        assert c1.latitude.values.tolist() == c2.latitude.values.tolist()
+        info = coast.coastline_cache_info()
+        assert info['hits'] == 1
+        assert info['misses'] == 1
+        assert info['size'] == 1
+
+    def test_clips_cached_result_when_smaller_area(self, fake_coast_geometry):
+        coast.coastlines([60, 61], [5, 6], cache=True)
+        c = coast.coastlines([60.2, 60.3], [5.2, 5.3], cache=True)
+        assert len(fake_coast_geometry) == 1
+        assert c.sizes['patch_num'] == 1
+        assert c.latitude.min() >= 60.2
+        assert c.longitude.max() <= 5.3
+
+    def test_does_not_cache_unless_specified(self, fake_coast_geometry):
+        coast.coastlines([60, 61], [5, 6])
+        coast.coastlines([60, 61], [5, 6])
+        assert len(fake_coast_geometry) == 2
+        assert coast.coastline_cache_info()['size'] == 0
+
+    def test_evicts_oldest_entry_when_full(self, fake_coast_geometry, monkeypatch):
+        monkeypatch.setattr(coast, 'COASTLINE_CACHE_MAXBYTES', 250)
+        coast.coastlines([60, 61], [5, 6], cache=True)
+        coast.coastlines([59, 60], [5, 6], cache=True)
+        assert coast.coastline_cache_info()['size'] == 1
+        coast.coastlines([60, 61], [5, 6], cache=True)
+        assert len(fake_coast_geometry) == 3
+
+    def test_caches_each_level_of_detail_separately(self, fake_coast_geometry):
+        coast.coastlines([60, 61], [5, 6], cache=True)
+        coast.coastlines([60, 61], [5, 6], cache=True, tolerance=1000)
+        coast.coastlines([60, 61], [5, 6], cache=True, tolerance=1500)
+        assert len(fake_coast_geometry) == 2
+        assert coast.coastline_cache_info()['size'] == 2
+
+    def test_caches_by_level_of_the_tile_store(self, fake_coast_geometry,
+                                               monkeypatch):
+        levels = [50, 200, 1000, 2000, 5000]
+        monkeypatch.setattr(coast, '_tile_store', lambda source: (None, levels))
+        coast.coastlines([60, 61], [5, 6], cache=True, tolerance=1500)
+        coast.coastlines([60, 61], [5, 6], cache=True, tolerance=3000)
+        assert len(fake_coast_geometry) == 2
+        assert coast.coastline_cache_info()['size'] == 2
+
+
+class Test_tile_store:
+    def test_opens_tile_store_once(self, shapefile, tmp_path, monkeypatch):
+        tile_file = tmp_path.joinpath('tiles.gpkg')
+        coast.build_tiles(shapefile, tile_file, levels=(300, ))
+        calls = []
+
+        def tiled_resource(name):
+            calls.append(name)
+            return tile_file
+
+        monkeypatch.setattr(coast, 'tiled_resource', tiled_resource)
+        monkeypatch.setattr(coast, '_tile_stores', {})
+        assert coast._tile_store('test') == (tile_file, (300, ))
+        assert coast._tile_store('test') == (tile_file, (300, ))
+        assert len(calls) == 1
+
+    def test_forgets_tile_store_when_rebuilt(self, shapefile, tmp_path,
+                                            monkeypatch):
+        tile_file = tmp_path.joinpath('tiles.gpkg')
+        coast.build_tiles(shapefile, tile_file, levels=(300, ))
+        monkeypatch.setattr(coast, 'tiled_resource', lambda name: tile_file)
+        monkeypatch.setattr(coast, '_tile_stores', {})
+        assert coast._tile_store('test')[1] == (300, )
+        coast.build_tiles(shapefile, tile_file, levels=(500, ))
+        assert coast._tile_store('test')[1] == (500, )
+
+
+class Test_coastlines_batch:
+    @pytest.fixture()
+    def fake_source(self, monkeypatch):
+        import numpy as np
+        import shapely
+        calls = []
+        geoms = shapely.buffer(shapely.points([5.2, 5.8, 6.1], [60.2, 60.3, 60.8]), 0.15)
+
+        def read_geometries(latlim, lonlim, source, tolerance=None,
+                            store=None):
+            clipped = shapely.clip_by_rect(
+                geoms, lonlim[0], latlim[0], lonlim[1], latlim[1])
+            return clipped[~shapely.is_empty(clipped)]
+
+        def read_box_geometries(rects, source, tolerance=None):
+            calls.append(rects)
+            return np.array([shapely.multipolygons(geoms)])  # A single tile
+
+        monkeypatch.setattr(coast, '_read_geometries', read_geometries)
+        monkeypatch.setattr(coast, '_read_box_geometries', read_box_geometries)
+        return calls
+
+    boxes = [
+        ([60, 60.5], [5, 5.5]),
+        ([60.1, 60.4], [5.1, 6]),
+        ([60.6, 61], [6, 6.5]),
+        ([59, 59.5], [5, 5.5]),
+    ]
+
+    def test_same_result_as_separate_calls(self, fake_source):
+        results = coast.coastlines_batch(self.boxes)
+        assert len(fake_source) == 1
+        assert len(results) == len(self.boxes)
+        for (latlim, lonlim), c_batch in zip(self.boxes, results):
+            c = coast.coastlines(latlim, lonlim)
+            assert c_batch.sizes['patch_num'] == c.sizes['patch_num']
+            assert c_batch.latitude.values.tolist() == c.latitude.values.tolist()
+            assert c_batch.longitude.values.tolist() == c.longitude.values.tolist()
+        assert results[-1].sizes['patch_num'] == 0
+
+    def test_sends_only_clipped_polygons_to_workers(self, fake_source, monkeypatch):
+        import shapely
+        tasks = []
+        merge_box = coast._merge_box
+
+        def recording_merge_box(geoms):
+            tasks.append(geoms)
+            return merge_box(geoms)
+
+        monkeypatch.setattr(coast, '_merge_box', recording_merge_box)
+        coast.coastlines_batch(self.boxes)
+        for (latlim, lonlim), geoms in zip(self.boxes, tasks):
+            assert len(geoms) <= 2
+            assert shapely.get_type_id(geoms).tolist() == [3] * len(geoms)
+            if len(geoms):
+                xmin, ymin, xmax, ymax = shapely.total_bounds(geoms)
+                assert lonlim[0] <= xmin and xmax <= lonlim[1]
+                assert latlim[0] <= ymin and ymax <= latlim[1]
+
+    def test_same_result_when_multiple_workers(self, fake_source):
+        serial = coast.coastlines_batch(self.boxes)
+        parallel = coast.coastlines_batch(self.boxes, workers=2)
+        for c1, c2 in zip(serial, parallel):
+            assert c1.latitude.values.tolist() == c2.latitude.values.tolist()
+
+    def test_returns_empty_list_when_no_boxes(self, fake_source):
+        assert coast.coastlines_batch([]) == []
+        assert len(fake_source) == 0
+
+
+class Test_tile_layer:
+    def test_selects_coarsest_level_within_tolerance(self):
+        assert coast.tile_layer(None) == 'tiles'
+        assert coast.tile_layer(10) == 'tiles'
+        assert coast.tile_layer(200) == 'tiles_200m'
+        assert coast.tile_layer(999) == 'tiles_200m'
+        assert coast.tile_layer(1e6) == f'tiles_{max(coast.PYRAMID_LEVELS)}m'
+
+    def test_selects_among_given_levels(self):
+        assert coast.tile_layer(500, levels=[300, 2000]) == 'tiles_300m'
+        assert coast.tile_layer(5000, levels=[300, 2000]) == 'tiles_2000m'
+        assert coast.tile_layer(100, levels=[300, 2000]) == 'tiles'
+        assert coast.tile_layer(3, levels=[2.5]) == 'tiles_2.5m'
+
+
+class Test_merged_areas_holes:
+    def test_keeps_interior_rings(self, lake_and_island):
+        c = coast.merged_areas(lake_and_island)
+        assert c.sizes['patch_num'] == 2
+        assert c.sizes['part_num'] == 3
+        assert c.interior_ring.values.tolist() == [0, 1, 0]
+        assert c.part_node_count.values.tolist() == [5, 5, 5]
+        assert c.patchsize.values.tolist() == [10, 5]
+        assert c.sizes['node_num'] == 15
+
+    def test_orients_rings_as_cf_conventions(self, lake_and_island):
+        import numpy as np
+        import shapely
+        c = coast.merged_areas(lake_and_island)
+        rings = np.split(
+            np.stack([c.longitude.values, c.latitude.values], axis=1),
+            np.cumsum(c.part_node_count.values)[:-1])
+        is_ccw = shapely.is_ccw(shapely.linearrings(rings)).tolist()
+        assert is_ccw == [not i for i in c.interior_ring.values.astype(bool)]
+
+    def test_uses_int32_counts(self, lake_and_island):
+        c = coast.merged_areas(lake_and_island)
+        assert c.patchsize.dtype == 'int32'
+        assert c.part_node_count.dtype == 'int32'
+        assert c.interior_ring.dtype == 'int32'
+
+    def test_has_cf_geometry_container(self, lake_and_island):
+        c = coast.merged_areas(lake_and_island)
+        attrs = c.geometry_container.attrs
+        assert attrs['geometry_type'] == 'polygon'
+        assert attrs['node_count'] == 'patchsize'
+        assert attrs['part_node_count'] == 'part_node_count'
+
+
+class Test_LandMask:
+    @pytest.fixture(scope='class')
+    def dset(self, lake_and_island):
+        return coast.merged_areas(lake_and_island)
+
+    def test_correct_when_land_lake_and_island(self, dset):
+        mask = coast.LandMask.from_dataset(dset)
+        lon = [5.1, 5.3, 5.5, 6.5]
+        lat = [60.5, 60.5, 60.5, 60.5]
+        assert mask.is_on_land(lon, lat).tolist() == [True, False, True, False]
+
+    def test_preserves_shape(self, dset):
+        import numpy as np
+        mask = coast.LandMask.from_dataset(dset)
+        lon, lat = np.meshgrid(np.linspace(4, 7, 5), np.linspace(59, 62, 4))
+        assert mask.is_on_land(lon, lat).shape == (4, 5)
+
+    def test_dataset_geometry_reverses_merged_areas(self, dset):
+        geom = coast.dataset_geometry(dset)
+        assert len(geom.geoms) == 2
+        assert abs(geom.area - (1 - 0.36 + 0.04)) < 1e-12
+
+    def test_same_result_as_exact_test_when_complex_coastline(self):
+        import numpy as np
+        import shapely
+        rng = np.random.default_rng(0)
+        centers = shapely.points(rng.uniform(5, 6, 300), rng.uniform(60, 61, 300))
+        geom = coast.merged_geometry(shapely.buffer(centers, 0.03))
+        lon = rng.uniform(4.9, 6.1, 10000)
+        lat = rng.uniform(59.9, 61.1, 10000)
+
+        mask = coast.LandMask(geom)
+        expected = shapely.contains_xy(geom, lon, lat)
+        assert mask.is_on_land(lon, lat).tolist() == expected.tolist()
+
+    def test_not_on_land_when_non_finite_positions(self, dset):
+        import numpy as np
+        import warnings
+        mask = coast.LandMask.from_dataset(dset)
+        lon = [5.1, np.nan, 5.5, 5.1]
+        lat = [60.5, 60.5, np.inf, 60.5]
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            result = mask.is_on_land(lon, lat)
+        assert result.tolist() == [True, False, False, True]
+
+    def test_nothing_on_land_when_empty(self):
+        mask = coast.LandMask([])
+        assert mask.is_on_land([5, 6], [60, 61]).tolist() == [False, False]
+
+
+class Test_distance_to_coast:
+    def test_correct_distance_and_nearest_point(self):
+        from shapely.geometry import box
+        land = box(5, 60, 6, 61)
+        dist, lon, lat = coast.distance_to_coast([6.1], [60.5], land)
+
+        # One tenth of a degree of longitude at 60.5 degrees north
+        assert abs(dist[0] - 5480) < 50
+        assert abs(lon[0] - 6) < 1e-4
+        assert abs(lat[0] - 60.5) < 1e-3
+
+    def test_measures_distance_to_coastline_when_on_island(self):
+        from shapely.geometry import box
+        island = box(5, 60, 6, 61)
+        dist, _, _ = coast.distance_to_coast([5.5], [60.99], island)
+        assert abs(dist[0] - 1113) < 20
+
+    def test_ignores_clipping_boundary_when_clipped_mainland(self):
+        import shapely
+        from shapely.geometry import box
+        mainland = box(0, 50, 6, 70)  # Coastline along 6 degrees east
+        latlim, lonlim = [60, 61], [5, 7]
+        clipped = shapely.clip_by_rect(mainland, 5, 60, 7, 61)
+        c = coast._set_clip_box(coast.merged_areas([clipped]), latlim, lonlim)
+
+        # Position on land, close to the northern clipping boundary
+        dist, lon, _ = coast.distance_to_coast([5.5], [60.99], c)
+        assert abs(dist[0] - 0.5 * 111320 * 0.4848) < 200
+        assert abs(lon[0] - 6) < 1e-4
+
+        # Same result when the clipping area is given explicitly
+        clipped = coast.dataset_geometry(c)
+        dist2, _, _ = coast.distance_to_coast(
+            [5.5], [60.99], clipped, clip_box=(latlim, lonlim))
+        assert dist2[0] == dist[0]
+
+    def test_records_clipping_area(self):
+        c = coast.merged_areas([])
+        coast._set_clip_box(c, [60, 61], [5, 7])
+        assert coast._clip_box(c) == ((60, 61), (5, 7))
+
+    def test_same_result_when_multiple_workers(self, monkeypatch):
+        import numpy as np
+        from shapely.geometry import box
+        from imr.maps import crs
+        monkeypatch.setattr(crs, 'CHUNK_SIZE', 100)
+        land = coast.merged_areas([box(5, 60, 6, 61), box(6.2, 60, 6.5, 60.3)])
+        rng = np.random.default_rng(0)
+        lon = rng.uniform(4, 7, 1000)
+        lat = rng.uniform(59, 62, 1000)
+        serial = coast.distance_to_coast(lon, lat, land)
+        parallel = coast.distance_to_coast(lon, lat, land, workers=4)
+        for a, b in zip(serial, parallel):
+            assert np.all(a == b)
+
+    def test_skips_positions_which_are_nan(self):
+        import numpy as np
+        from shapely.geometry import box
+        land = box(5, 60, 6, 61)
+        dist, lon, lat = coast.distance_to_coast(
+            [6.1, np.nan, 5.5], [60.5, 60.5, 60.99], land)
+        assert abs(dist[0] - 5480) < 50
+        assert dist[1] == np.inf
+        assert np.isnan(lon[1]) and np.isnan(lat[1])
+        assert abs(dist[2] - 1113) < 20
+
+        dist, _, _ = coast.distance_to_coast([6.1, np.nan], [60.5, np.nan], land)
+        assert abs(dist[0] - 5480) < 50
+        assert dist[1] == np.inf
+
+
+class Test_land_mask:
+    def test_marks_cells_on_land(self, fake_coast_geometry):
+        import numpy as np
+        from imr.maps import crs
+        lon = np.arange(4.55, 6, 0.1)
+        lat = np.arange(59.55, 61, 0.1)
+        mask = coast.land_mask(lon, lat, crs.crs_from_epsg('wgs84'))
+        assert mask.dims == ('y', 'x')
+        assert mask.shape == (len(lat), len(lon))
+        expected = (
+            (lat[:, np.newaxis] > 60) & (lat[:, np.newaxis] < 60.5)
+            & (lon > 5) & (lon < 5.5)
+        )
+        assert mask.values.astype(bool).tolist() == expected.tolist()
+
+    def test_marks_cells_on_land_when_projected_grid(self, fake_coast_geometry):
+        import numpy as np
+        from imr.maps import crs
+        wgs84 = crs.crs_from_epsg('wgs84')
+        nk800 = crs.crs_nk800()
+
+        # Grid placed asymmetrically around the land box, so that a flipped
+        # or transposed grid gives a different result
+        xc, yc = crs.crs_transform(
+            np.array([5.25]), np.array([60.25]), wgs84, nk800)
+        x = np.round(xc[0]) + np.arange(-60, 21)
+        y = np.round(yc[0]) + np.arange(-20, 81)
+        mask = coast.land_mask(x, y, nk800, tilesize=32)
+        assert mask.shape == (len(y), len(x))
+
+        xx, yy = np.meshgrid(x, y)
+        lon, lat = crs.crs_transform(xx, yy, nk800, wgs84)
+        margin = 0.02
+        land = (lon > 5 + margin) & (lon < 5.5 - margin) & (
+            lat > 60 + margin) & (lat < 60.5 - margin)
+        sea = (lon < 5 - margin) | (lon > 5.5 + margin) | (
+            lat < 60 - margin) | (lat > 60.5 + margin)
+        assert np.any(land) and np.any(sea)
+        assert np.all(mask.values[land] == 1)
+        assert np.all(mask.values[sea] == 0)
+
+    def test_gives_fractional_coverage_when_supersampled(self, fake_coast_geometry):
+        import numpy as np
+        from imr.maps import crs
+        lon = np.array([4.9, 5.0, 5.1])
+        lat = np.array([60.2, 60.3])
+        mask = coast.land_mask(lon, lat, crs.crs_from_epsg('wgs84'),
+                               supersample=4)
+        assert mask.values.tolist() == [[0, 0.5, 1], [0, 0.5, 1]]
+
+    def test_same_result_when_tiled(self, fake_coast_geometry):
+        import numpy as np
+        from imr.maps import crs
+        lon = np.arange(4.55, 6, 0.1)
+        lat = np.arange(59.55, 61, 0.1)
+        wgs84 = crs.crs_from_epsg('wgs84')
+        mask = coast.land_mask(lon, lat, wgs84, supersample=2)
+        mask_tiled = coast.land_mask(lon, lat, wgs84, supersample=2, tilesize=4)
+        assert np.all(mask.values == mask_tiled.values)
+
+    def test_uses_grid_of_dataset(self, fake_coast_geometry):
+        import numpy as np
+        import xarray as xr
+        from imr.maps import crs
+        lon = np.arange(4.55, 6, 0.1)
+        lat = np.arange(59.55, 61, 0.1)
+        dset = crs.set_crs(
+            dset=xr.Dataset(
+                data_vars=dict(temp=(('Y', 'X'), np.zeros((len(lat), len(lon))))),
+                coords=dict(X=lon, Y=lat),
+            ),
+            crs=crs.crs_from_epsg('wgs84'),
+            coords=['X', 'Y'],
+            data_vars=['temp'],
+        )
+        mask = coast.land_mask_from_dataset(dset)
+        expected = coast.land_mask(lon, lat, crs.crs_from_epsg('wgs84'))
+        assert mask.dims == ('Y', 'X')
+        assert mask.attrs['grid_mapping'] == 'crs_def'
+        assert np.all(mask.values == expected.values)
+        assert np.all(mask.X.values == lon)
+
+    def test_raises_error_when_two_dimensional_coordinates(self):
+        import numpy as np
+        import xarray as xr
+        from imr.maps import crs
+        lon, lat = np.meshgrid(np.arange(4.55, 6, 0.1), np.arange(59.55, 61, 0.1))
+        dset = crs.set_crs(
+            dset=xr.Dataset(
+                data_vars=dict(temp=(('Y', 'X'), np.zeros(lon.shape))),
+                coords=dict(lon=(('Y', 'X'), lon), lat=(('Y', 'X'), lat)),
+            ),
+            crs=crs.crs_from_epsg('wgs84'),
+            data_vars=['temp'],
+        )
+        with pytest.raises(ValueError):
+            coast.land_mask_from_dataset(dset, coords=['lon', 'lat'])
@@ -178,6 +178,56 @@ class Test_change_crs:
         assert dset1d_wgs84.lat1d.shape == (2, )
         assert dset1d_wgs84.lon1d.shape == (3, )
 
+    def test_transforms_only_axes_when_nk800_to_nk800m(self, monkeypatch):
+        dset = crs.set_crs(
+            dset=xr.Dataset(
+                data_vars=dict(myvar=(('Y', 'X'), [[1., 2, 3], [4, 5, 6]])),
+                coords=dict(X=[0., 1, 2], Y=[10., 11]),
+            ),
+            crs=crs.crs_nk800(),
+            coords=['X', 'Y'],
+            data_vars=['myvar'],
+        )
+
+        def no_pointwise_transform(*_, **__):
+            raise AssertionError('Pointwise transform should not be used')
+        monkeypatch.setattr(crs, 'crs_transform', no_pointwise_transform)
+
+        dset_m = crs.change_crs(
+            dset=dset, old_coords=['X', 'Y'], old_crs='crs_def',
+            new_coords=['x', 'y'], new_crs=crs.crs_nk800(metric_unit=True),
+        )
+        assert dset_m.x.dims == ('x', )
+        assert dset_m.y.dims == ('y', )
+        assert np.allclose(dset_m.x.values, [0, 800, 1600])
+        assert np.allclose(dset_m.y.values, [8000, 8800])
+        assert dset_m.myvar.dims == ('y', 'x')
+
+
+class Test_max_abs_diff:
+    def test_returns_nan_when_non_finite_points(self, monkeypatch):
+        monkeypatch.setattr(crs, 'CHUNK_SIZE', 2)
+        arr = np.array([[1., 1], [1, 1], [np.inf, np.inf], [np.inf, np.inf], [1, 1]])
+        assert np.isnan(crs._max_abs_diff(arr, axis=0))
+        assert np.isnan(crs._max_abs_diff(arr[::-1], axis=0))
+
+    def test_returns_maximal_difference(self, monkeypatch):
+        monkeypatch.setattr(crs, 'CHUNK_SIZE', 2)
+        arr = np.array([[1., 2], [1, 2], [4, 2], [4, 2]])
+        assert crs._max_abs_diff(arr, axis=0) == 3
+        assert crs._max_abs_diff(arr, axis=1) == 2
+
+
+class Test_separable_transformer:
+    def test_no_shortcut_when_only_axis_order_differs(self):
+        crs84 = SpatialReference()
+        crs84.SetFromUserInput('OGC:CRS84')
+        assert crs._separable_transformer(wgs84, crs84) is None
+
+    def test_identity_when_same_crs(self):
+        transform = crs._separable_transformer(wgs84, wgs84.Clone())
+        assert transform is crs._identity_transform
+
 
 class Test_local:
     def test_is_valid_spatial_reference(self):
@@ -185,6 +235,29 @@ class Test_local:
         assert isinstance(sr, osr.SpatialReference)
         assert sr.ExportToWkt()
 
+    def test_accepts_zero_dimensional_arrays(self):
+        sr = crs.crs_local(lon=np.array(5.), lat=np.array(60.))
+        assert sr.IsSame(crs.crs_local(lon=5, lat=60))
+
+
+class Test_from_epsg:
+    def test_accepts_named_codes(self):
+        sr = crs.crs_from_epsg('utm33n')
+        assert sr.IsSame(crs.crs_from_epsg(32633))
+
+    def test_returns_independent_objects_when_cached(self):
+        sr1 = crs.crs_from_epsg(25833)
+        sr1.SetProjCS('Modified')
+        sr2 = crs.crs_from_epsg(25833)
+        assert sr1 is not sr2
+        assert sr2.GetAttrValue('PROJCS') != 'Modified'
+
+    def test_shares_cache_between_names_and_codes(self):
+        crs.crs_from_epsg('etrs89')
+        hits = crs._crs_from_epsg.cache_info().hits
+        crs.crs_from_epsg(4258)
+        assert crs._crs_from_epsg.cache_info().hits == hits + 1
+
 
 class Test_nf160:
     def test_is_valid_spatial_reference(self):
@@ -199,6 +272,14 @@ class Test_nk800:
         assert isinstance(sr, osr.SpatialReference)
         assert sr.ExportToWkt()
 
+    def test_returns_equal_spatial_reference_when_cached(self):
+        crs.crs_nk800.cache_clear()
+        sr1 = crs.crs_nk800()
+        sr2 = crs.crs_nk800()
+        assert crs.crs_nk800.cache_info().hits == 1
+        assert sr1 is not sr2
+        assert sr1.IsSame(sr2)
+
 
 class Test_transform:
     def test_unchanged_when_wgs84_to_wgs84(self):
@@ -313,6 +394,56 @@ class Test_transform:
         assert np.all(np.isclose(ym, [0, 0, 1], atol=1e-5))
 
 
+class Test_transform_polar_stereographic:
+    @staticmethod
+    def gdal_transform(x, y, from_crs, to_crs):
+        from osgeo.osr import CoordinateTransformation
+        ct = CoordinateTransformation(from_crs, to_crs)
+        points = np.stack([x.ravel(), y.ravel(), np.zeros(x.size)]).T
+        result = np.array(ct.TransformPoints(points))
+        return result[:, 0].reshape(x.shape), result[:, 1].reshape(y.shape)
+
+    @pytest.fixture(scope='class')
+    def lonlat(self):
+        lon, lat = np.meshgrid(np.linspace(-10, 40, 51), np.linspace(50, 80, 31))
+        return lon, lat
+
+    @pytest.mark.parametrize('grid', [
+        crs.crs_nk800(), crs.crs_nk800(True), crs.crs_nf160('A05', True),
+    ])
+    def test_matches_gdal_within_millimetre_when_to_grid(self, lonlat, grid):
+        lon, lat = lonlat
+        x, y = crs.crs_transform(lon, lat, wgs84, grid)
+        x_gdal, y_gdal = self.gdal_transform(lon, lat, wgs84, grid)
+        assert x.shape == lon.shape
+        unit = grid.GetLinearUnits()
+        assert np.max(np.abs(x - x_gdal)) * unit < 1e-3
+        assert np.max(np.abs(y - y_gdal)) * unit < 1e-3
+
+    @pytest.mark.parametrize('grid', [
+        crs.crs_nk800(), crs.crs_nk800(True), crs.crs_nf160('A05', True),
+    ])
+    def test_matches_gdal_within_millimetre_when_from_grid(self, lonlat, grid):
+        x, y = self.gdal_transform(*lonlat, wgs84, grid)
+        lon, lat = crs.crs_transform(x, y, grid, wgs84)
+        lon_gdal, lat_gdal = self.gdal_transform(x, y, grid, wgs84)
+        meters_per_degree = 111320
+        assert np.max(np.abs(lat - lat_gdal)) * meters_per_degree < 1e-3
+        assert np.max(np.abs(lon - lon_gdal)) * meters_per_degree < 1e-3
+
+    def test_does_not_use_gdal_when_nk800_to_wgs84(self):
+        crs.clear_transform_cache()
+        crs.crs_transform([0, 1], [0, 1], crs.crs_nk800(), wgs84)
+        assert crs.transform_cache_info()['misses'] == 0
+
+    def test_affine_when_nk800_to_nf160(self):
+        nk800 = crs.crs_nk800()
+        nf160 = crs.crs_nf160('A01')
+        x, y = crs.crs_transform([0, 1], [0, 1], nk800, nf160)
+        assert np.allclose(x, [(0 - 3991) * 5 + 18704, (1 - 3991) * 5 + 18704])
+        assert np.allclose(y, [(0 - 2230) * 5 + 10752, (1 - 2230) * 5 + 10752])
+
+
 class Test_crs_to_gridmapping:
     def test_returns_correct_attributes_when_wgs84(self):
         gridmapping = crs.crs_to_gridmapping(wgs84)
@@ -354,3 +485,352 @@ class Test_crs_to_gridmapping:
             'false_northing',
             'longitude_of_prime_meridian',
         )
+
+    def test_returns_independent_attributes_when_cached(self):
+        gridmapping1 = crs.crs_to_gridmapping(crs.crs_nk800())
+        gridmapping1.attrs['long_name'] = 'Modified'
+        gridmapping2 = crs.crs_to_gridmapping(crs.crs_nk800())
+        assert gridmapping2.attrs['long_name'] == 'CRS definition'
+
+
+class Test_get_transformation:
+    def test_reuses_transformation_when_equal_crs(self):
+        crs.clear_transform_cache()
+        ct1 = crs.get_transformation(crs.crs_nk800(), wgs84)
+        ct2 = crs.get_transformation(crs.crs_nk800(), wgs84)
+        assert ct1 is ct2
+
+        info = crs.transform_cache_info()
+        assert info['hits'] == 1
+        assert info['misses'] == 1
+        assert info['size'] == 1
+
+    def test_discards_least_recently_used_when_full(self, monkeypatch):
+        monkeypatch.setattr(crs, 'TRANSFORM_CACHE_SIZE', 2)
+        crs.clear_transform_cache()
+        ct_nk800 = crs.get_transformation(crs.crs_nk800(), wgs84)
+        crs.get_transformation(crs.crs_nf160('A01'), wgs84)
+        crs.get_transformation(crs.crs_nf160('A02'), wgs84)
+        assert crs.transform_cache_info()['size'] == 2
+
+        ct_nk800_new = crs.get_transformation(crs.crs_nk800(), wgs84)
+        assert ct_nk800_new is not ct_nk800
+        assert crs.transform_cache_info()['misses'] == 4
+
+    def test_used_by_crs_transform(self):
+        crs.clear_transform_cache()
+        utm = crs.crs_from_epsg(25833)
+        crs.crs_transform([5, 6], [60, 61], wgs84, utm)
+        crs.crs_transform([7, 8], [60, 61], wgs84, utm)
+        assert crs.transform_cache_info()['hits'] == 1
+
+
+class Test_transform_chunked:
+    @pytest.fixture(scope='class')
+    def lonlat(self):
+        lon, lat = np.meshgrid(np.linspace(4, 6, 7), np.linspace(59, 61, 5))
+        return lon, lat
+
+    def test_same_result_when_small_chunks(self, lonlat):
+        utm = crs.crs_from_epsg(25833)
+        x, y = crs.crs_transform(*lonlat, wgs84, utm)
+        x_chunk, y_chunk = crs.crs_transform(*lonlat, wgs84, utm, chunksize=4)
+        assert np.all(x == x_chunk)
+        assert np.all(y == y_chunk)
+
+    def test_writes_to_output_arrays_if_given(self, lonlat):
+        utm = crs.crs_from_epsg(25833)
+        out = (np.empty(lonlat[0].shape), np.empty(lonlat[1].shape))
+        x, y = crs.crs_transform(*lonlat, wgs84, utm, out=out, chunksize=4)
+        assert x is out[0]
+        assert y is out[1]
+        x_expected, y_expected = crs.crs_transform(*lonlat, wgs84, utm)
+        assert np.all(x == x_expected)
+        assert np.all(y == y_expected)
+
+    def test_returns_output_arrays_when_empty_input(self):
+        utm = crs.crs_from_epsg(25833)
+        out = (np.empty(0), np.empty(0))
+        x, y = crs.crs_transform(np.empty(0), np.empty(0), wgs84, utm, out=out)
+        assert x is out[0]
+        assert y is out[1]
+
+    def test_can_transform_in_place(self, lonlat):
+        nk800 = crs.crs_nk800()
+        x_expected, y_expected = crs.crs_transform(*lonlat, wgs84, nk800)
+        lon, lat = lonlat[0].copy(), lonlat[1].copy()
+        crs.crs_transform(lon, lat, wgs84, nk800, out=(lon, lat), chunksize=3)
+        assert np.all(lon == x_expected)
+        assert np.all(lat == y_expected)
+
+    def test_accepts_noncontiguous_arrays(self, lonlat):
+        lon, lat = lonlat[0].T, lonlat[1].T
+        out = (np.empty(lon.shape[::-1]).T, np.empty(lat.shape))
+        x, y = crs.crs_transform(lon, lat, wgs84, wgs84, out=out, chunksize=4)
+        assert np.allclose(x, lon)
+        assert np.allclose(y, lat)
+
+    def test_raises_valueerror_if_wrong_output_shape(self, lonlat):
+        out = (np.empty(3), np.empty(3))
+        with pytest.raises(ValueError):
+            crs.crs_transform(*lonlat, wgs84, wgs84, out=out)
+
+
+class Test_transform_workers:
+    def test_same_result_when_multiple_workers(self):
+        lon, lat = np.meshgrid(np.linspace(4, 6, 70), np.linspace(59, 61, 50))
+        utm = crs.crs_from_epsg(25833)
+        x, y = crs.crs_transform(lon, lat, wgs84, utm)
+        x_par, y_par = crs.crs_transform(
+            lon, lat, wgs84, utm, chunksize=100, workers=4)
+        assert np.all(x == x_par)
+        assert np.all(y == y_par)
+
+    def test_same_result_when_multiple_workers_and_fast_path(self):
+        lon, lat = np.meshgrid(np.linspace(4, 6, 70), np.linspace(59, 61, 50))
+        nk800 = crs.crs_nk800()
+        x, y = crs.crs_transform(lon, lat, wgs84, nk800)
+        x_par, y_par = crs.crs_transform(
+            lon, lat, wgs84, nk800, chunksize=100, workers=4)
+        assert np.all(x == x_par)
+        assert np.all(y == y_par)
+
+    def test_uses_given_spatial_references(self, monkeypatch):
+        def fail(key):
+            raise AssertionError('Spatial reference rebuilt from WKT')
+
+        monkeypatch.setattr(crs, '_crs_from_key', fail)
+        crs.clear_transform_cache()
+        lon, lat = np.meshgrid(np.linspace(4, 6, 70), np.linspace(59, 61, 50))
+        utm = crs.crs_from_epsg(25833)
+        x, y = crs.crs_transform(lon, lat, wgs84, utm, chunksize=100, workers=4)
+        assert np.all(np.isfinite(x)) and np.all(np.isfinite(y))
+
+    def test_reuses_cached_transformation_across_calls(self):
+        lon, lat = np.meshgrid(np.linspace(4, 6, 70), np.linspace(59, 61, 50))
+        utm = crs.crs_from_epsg(25833)
+        misses = crs.transform_cache_info()['misses']
+        for _ in range(10):
+            crs.crs_transform(lon, lat, wgs84, utm, chunksize=100, workers=4)
+        # At most one new transformation per thread, not one per call
+        new_misses = crs.transform_cache_info()['misses'] - misses
+        assert new_misses <= crs._thread_pool_size + 1
+
+
+    def test_succeeds_when_pool_grows_during_transform(self, monkeypatch):
+        import threading
+        monkeypatch.setattr(crs, '_thread_pool', None)
+        monkeypatch.setattr(crs, '_thread_pool_size', 0)
+        lon, lat = np.meshgrid(np.linspace(4, 6, 70), np.linspace(59, 61, 50))
+        utm = crs.crs_from_epsg(25833)
+        errors = []
+
+        def transform(workers):
+            try:
+                for _ in range(5):
+                    crs.crs_transform(
+                        lon, lat, wgs84, utm, chunksize=100, workers=workers)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=transform, args=(w, ))
+                   for w in (2, 4, 6, 8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+
+
+class Test_parallel_map:
+    def test_calls_function_once_for_each_item(self):
+        import threading
+        lock = threading.Lock()
+        seen = []
+
+        def func(item):
+            with lock:
+                seen.append(item)
+
+        crs._parallel_map(func, range(100), workers=4)
+        assert sorted(seen) == list(range(100))
+
+    def test_raises_exception_of_function(self):
+        def func(item):
+            if item == 7:
+                raise ValueError('Bad item')
+
+        with pytest.raises(ValueError):
+            crs._parallel_map(func, range(20), workers=4)
+
+    def test_completes_when_called_from_pool_thread(self):
+        seen = []
+
+        def outer(item):
+            crs._parallel_map(seen.append, [item] * 3, workers=4)
+
+        crs._parallel_map(outer, range(8), workers=2)
+        assert len(seen) == 24
+
+    def test_old_pool_usable_when_pool_grows(self, monkeypatch):
+        monkeypatch.setattr(crs, '_thread_pool', None)
+        monkeypatch.setattr(crs, '_thread_pool_size', 0)
+        old_pool = crs._get_thread_pool(2)
+        new_pool = crs._get_thread_pool(4)
+        assert new_pool is not old_pool
+        assert old_pool.submit(lambda: 1).result() == 1
+
+
+class Test_transform_lazy:
+    def test_returns_lazy_result_when_dask_input(self):
+        da = pytest.importorskip('dask.array')
+        lon, lat = np.meshgrid(np.linspace(4, 6, 7), np.linspace(59, 61, 5))
+        utm = crs.crs_from_epsg(25833)
+        x, y = crs.crs_transform(
+            da.from_array(lon, chunks=3), da.from_array(lat, chunks=3),
+            wgs84, utm)
+        assert isinstance(x, da.Array)
+        assert isinstance(y, da.Array)
+
+        x_expected, y_expected = crs.crs_transform(lon, lat, wgs84, utm)
+        assert np.all(x.compute() == x_expected)
+        assert np.all(y.compute() == y_expected)
+
+    def test_change_crs_keeps_2d_coordinates_lazy(self):
+        pytest.importorskip('dask.array')
+        utm = crs.crs_from_epsg(25833)
+        dset = xr.Dataset(
+            data_vars=dict(myvar=(('lat', 'lon'), [[1., 2, 3], [4, 5, 6]])),
+            coords=dict(lat=[59., 60], lon=[4., 5, 6]),
+        )
+        dset_eager = crs.change_crs(
+            dset=crs.set_crs(dset, wgs84, ['lon', 'lat'], ['myvar']),
+            old_coords=['lon', 'lat'], old_crs='crs_def',
+            new_coords=['x', 'y'], new_crs=utm,
+        )
+        dset_lazy = crs.change_crs(
+            dset=dset_eager.chunk(dict(lat=1)),
+            old_coords=['x', 'y'], old_crs='crs_def',
+            new_coords=['lon2d', 'lat2d'], new_crs=wgs84,
+        )
+        assert dset_lazy.lon2d.chunks is not None
+        assert np.allclose(dset_lazy.lat2d.values, [[59] * 3, [60] * 3])
+
+
+class Test_GridIndex:
+    @pytest.fixture(scope='class')
+    def grid(self):
+        x, y = np.meshgrid(np.arange(40) + 500., np.arange(30) + 300.)
+        lon, lat = crs.crs_transform(x, y, crs.crs_nk800(), wgs84)
+        return lon, lat
+
+    @pytest.fixture(scope='class')
+    def positions(self):
+        rng = np.random.default_rng(0)
+        i = rng.uniform(-0.4, 39.4, 100)
+        j = rng.uniform(-0.4, 29.4, 100)
+        lon, lat = crs.crs_transform(i + 500, j + 300, crs.crs_nk800(), wgs84)
+        return i, j, lon, lat
+
+    def test_finds_fractional_index_when_curvilinear_grid(self, grid, positions):
+        i, j, lon, lat = positions
+        index = crs.GridIndex(*grid)
+        i_found, j_found = index.query(lon, lat)
+        assert np.max(np.abs(i_found - i)) < 1e-3
+        assert np.max(np.abs(j_found - j)) < 1e-3
+
+    def test_preserves_shape(self, grid, positions):
+        _, _, lon, lat = positions
+        index = crs.GridIndex(*grid)
+        i, j = index.query(lon.reshape((4, 25)), lat.reshape((4, 25)))
+        assert i.shape == (4, 25)
+        assert j.shape == (4, 25)
+
+    def test_returns_nan_when_outside_grid(self, grid):
+        index = crs.GridIndex(*grid)
+        i, j = index.query([0.], [0.])
+        assert np.isnan(i[0]) and np.isnan(j[0])
+
+    def test_returns_nan_when_non_finite_positions(self, grid, positions):
+        i, j, lon, lat = positions
+        lon, lat = lon[:5].copy(), lat[:5].copy()
+        lon[2] = np.nan
+        index = crs.GridIndex(*grid)
+        i_found, j_found = index.query(lon, lat)
+        assert np.isnan(i_found[2]) and np.isnan(j_found[2])
+        assert np.max(np.abs(i_found[[0, 1, 3, 4]] - i[[0, 1, 3, 4]])) < 1e-3
+        assert np.max(np.abs(j_found[[0, 1, 3, 4]] - j[[0, 1, 3, 4]])) < 1e-3
+
+    def test_returns_nan_when_far_inside_masked_area(self, grid):
+        mask = np.ones(grid[0].shape, dtype=bool)
+        mask[10:20, 10:20] = False
+        index = crs.GridIndex(*grid, mask=mask)
+        lon, lat = grid[0][15, 15], grid[1][15, 15]
+        i, j = index.query([lon], [lat])
+        assert np.isnan(i[0])
+
+    def test_raises_error_when_every_cell_masked(self, grid):
+        mask = np.zeros(grid[0].shape, dtype=bool)
+        with pytest.raises(ValueError):
+            crs.GridIndex(*grid, mask=mask)
+
+    def test_can_build_from_dataset_with_grid_mapping(self, positions):
+        dset = crs.set_crs(
+            dset=xr.Dataset(coords=dict(
+                X=np.arange(40) + 500., Y=np.arange(30) + 300.)),
+            crs=crs.crs_nk800(),
+            coords=['X', 'Y'],
+        )
+        index = crs.GridIndex.from_dataset(
+            dset, coords=['X', 'Y'], grid_mapping='crs_def')
+        i, j, lon, lat = positions
+        i_found, j_found = index.query(lon, lat)
+        assert np.max(np.abs(i_found - i)) < 1e-3
+        assert np.max(np.abs(j_found - j)) < 1e-3
+
+    def test_same_result_when_stored_and_loaded(self, grid, positions, tmp_path):
+        _, _, lon, lat = positions
+        index = crs.GridIndex(*grid)
+        fname = tmp_path / 'index.pickle'
+        index.save(fname)
+        loaded = crs.GridIndex.load(fname)
+        assert np.all(loaded.query(lon, lat)[0] == index.query(lon, lat)[0])
+
+
+class Test_crs_from_gridmapping:
+    def test_round_trip_gives_same_spatial_reference(self):
+        nf160 = crs.crs_nf160('A03', metric_unit=True)
+        gridmapping = crs.crs_to_gridmapping(nf160)
+        assert crs.crs_from_gridmapping(gridmapping).IsSame(nf160)
+
+    def test_parses_wkt_only_once(self):
+        gridmapping = crs.crs_to_gridmapping(crs.crs_local(lon=7, lat=61))
+        crs.crs_from_gridmapping(gridmapping)
+        hits = crs.crs_from_wkt.cache_info().hits
+        crs.crs_from_gridmapping(gridmapping)
+        assert crs.crs_from_wkt.cache_info().hits == hits + 1
+
+
+class Test_transform_many:
+    @pytest.fixture(scope='class')
+    def targets(self):
+        return [wgs84, crs.crs_from_epsg('utm33n'), crs.crs_nk800()]
+
+    def test_same_result_as_separate_transforms(self, targets):
+        lon = [5, 6, 7]
+        lat = [60, 61, 62]
+        results = crs.crs_transform_many(lon, lat, wgs84, targets)
+        assert len(results) == len(targets)
+        for (x, y), target in zip(results, targets):
+            x_expected, y_expected = crs.crs_transform(lon, lat, wgs84, target)
+            assert np.all(x == x_expected)
+            assert np.all(y == y_expected)
+
+    def test_same_result_when_parallel(self, targets):
+        lon, lat = np.meshgrid(np.linspace(4, 6, 7), np.linspace(59, 61, 5))
+        serial = crs.crs_transform_many(lon, lat, wgs84, targets)
+        parallel = crs.crs_transform_many(lon, lat, wgs84, targets, workers=3)
+        for (x, y), (x_par, y_par) in zip(serial, parallel):
+            assert x_par.shape == lon.shape
+            assert np.all(x == x_par)
+            assert np.all(y == y_par)
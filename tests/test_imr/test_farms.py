@@ -31,3 +31,10 @@ class Test_areas:
             '-38690.019275 6695668.944893,-38902.007508 6695649.481201))')
         assert a.transverse_mercator.spatial_ref.startswith(
             'PROJCS["WGS 84 / UTM zone 33N"')
+
+
+def test_raises_error_when_incremental_combined_with_reload():
+    with pytest.raises(ValueError):
+        farms.locations(reload=True, incremental=True)
+    with pytest.raises(ValueError):
+        farms.locations(expires=3600, incremental=True)
@@ -2,6 +2,111 @@ from imr.maps import wfs
 import pytest
 
 
+class FakeWFS:
+    """State and responses of a local stand-in WFS server"""
+    def __init__(self):
+        import threading
+        self.number_matched = 3
+        self.last_modified = 'Mon, 01 Jan 2024 00:00:00 GMT'
+        self.fail = False
+        self.requests = []
+        self.delay = 0
+        self.value = lambda i: i
+        self.max_count = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def respond(self, query):
+        if self.fail:
+            return 500, {}, b''
+        if 'propertyName' in query:
+            return self.respond_properties(query)
+        if query.get('resultType') != 'hits':
+            return self.respond_features(query)
+        body = (
+            '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+            f'numberMatched="{self.number_matched}" numberReturned="0"/>'
+        )
+        headers = {'Content-Type': 'text/xml'}
+        if self.last_modified is not None:
+            headers['Last-Modified'] = self.last_modified
+        return 200, headers, body.encode('utf-8')
+
+    def respond_properties(self, query):
+        import time
+        fields = query['propertyName'].split(',')
+        values = dict(idx=range(self.number_matched),
+                      value=[self.value(i) for i in range(self.number_matched)])
+        members = ''.join(
+            '<wfs:member>' + ''.join(f'<{f}>{values[f][i]}</{f}>' for f in fields)
+            + '</wfs:member>'
+            for i in range(self.number_matched)
+        )
+        body = (
+            '<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+            f'timeStamp="{time.time()}">{members}</wfs:FeatureCollection>'
+        )
+        return 200, {'Content-Type': 'text/xml'}, body.encode('utf-8')
+
+    def respond_features(self, query):
+        import json
+        import time
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+
+        start = int(query.get('startIndex', 0))
+        count = int(query.get('count', 1000000))
+        if self.max_count is not None:
+            count = min(count, self.max_count)
+        stop = min(self.number_matched, start + count)
+        features = [
+            dict(type='Feature', id=i, properties=dict(idx=i, value=self.value(i)),
+                 geometry=dict(type='Point', coordinates=[5, 60 + i / 1000]))
+            for i in range(start, stop)
+        ]
+        body = json.dumps(dict(type='FeatureCollection', features=features))
+        return 200, {'Content-Type': 'application/json'}, body.encode('utf-8')
+
+
+@pytest.fixture()
+def fake_wfs(monkeypatch, tmp_path):
+    import http.server
+    import threading
+    import urllib.parse
+
+    state = FakeWFS()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.path).query))
+            state.requests.append(query)
+            status, headers, body = state.respond(query)
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setitem(wfs.servers, 'fake', f'http://127.0.0.1:{server.server_port}/wfs')
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+    monkeypatch.setenv('no_proxy', '127.0.0.1')
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture(scope='module')
 def fiskdir_wfs():
     return wfs.get_wfs(wfs.servers['fiskdir'])
@@ -66,8 +171,10 @@ class Test_resource:
         import time
         assert os.path.isfile(sei_bw)
         expires = time.time() - os.path.getmtime(sei_bw) - 1
+        changed = dict(number_matched=-1, etag=None, last_modified=None)
 
-        with mock.patch('imr.maps.wfs.download_wfs_layer') as m:
+        with mock.patch('imr.maps.wfs.download_wfs_layer') as m, \
+                mock.patch('imr.maps.wfs.server_metadata', return_value=changed):
             fname = wfs.resource('fisk:Sei_bw', 'imr_fisk', expires=expires)
             assert fname == sei_bw
             assert m.call_count == 1
@@ -76,3 +183,418 @@ class Test_resource:
         import netCDF4 as nc
         with nc.Dataset(sei_bw) as dset:
             assert 'crs' in dset.variables.keys()
+
+
+class Test_download_wfs_layer:
+    @pytest.mark.parametrize('fmt', ['netCDF', 'Parquet'])
+    def test_writes_selected_format(self, fmt, tmp_path):
+        from osgeo import ogr
+        if ogr.GetDriverByName(fmt) is None:
+            pytest.skip(f'GDAL is built without the {fmt} driver')
+        outfile = tmp_path.joinpath('sei_bw')
+        fractions = []
+        wfs.download_wfs_layer(
+            'fisk:Sei_bw', wfs.servers['imr_fisk'], outfile, fmt=fmt,
+            progress=fractions.append)
+        dataSource = ogr.Open(str(outfile))
+        assert dataSource.GetDriver().GetName() == fmt
+        assert dataSource.GetLayer().GetFeatureCount() > 0
+        assert fractions[-1] == pytest.approx(1)
+
+    def test_raises_error_when_unknown_layer(self, tmp_path):
+        with pytest.raises(IOError):
+            wfs.download_wfs_layer(
+                'fisk:No_such_layer', wfs.servers['imr_fisk'],
+                tmp_path.joinpath('none'))
+
+
+class Test_resource_concurrency:
+    @pytest.fixture()
+    def fake_download(self, monkeypatch, tmp_path):
+        import threading
+        import time
+        monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+        calls = []
+        lock = threading.Lock()
+
+        def download_wfs_layer(layer, url, outfile, fmt='netCDF'):
+            with lock:
+                calls.append(outfile)
+            with open(outfile, 'w') as f:
+                f.write('partial ')
+                time.sleep(0.2)
+                f.write('complete')
+
+        monkeypatch.setattr(wfs, 'download_wfs_layer', download_wfs_layer)
+        return calls
+
+    def test_downloads_once_when_concurrent_callers(self, fake_download):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(wfs.resource, 'fisk:Sei_bw', 'imr_fisk')
+                for _ in range(8)
+            ]
+            fnames = [f.result() for f in futures]
+
+        assert len(fake_download) == 1
+        assert len(set(fnames)) == 1
+        with open(fnames[0]) as f:
+            assert f.read() == 'partial complete'
+
+    def test_downloads_once_when_concurrent_recompute(self, fake_download):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(wfs.resource, 'fisk:Sei_bw', 'imr_fisk',
+                                recompute=True)
+                for _ in range(4)
+            ]
+            for f in futures:
+                f.result()
+        assert len(fake_download) == 1
+
+    def test_recompute_ignores_clock_of_file_system(self, fake_download):
+        import os
+        import time
+        fname = wfs.resource('fisk:Sei_bw', 'imr_fisk')
+        future = time.time() + 3600
+        os.utime(fname, (future, future))
+        wfs.resource('fisk:Sei_bw', 'imr_fisk', recompute=True)
+        assert len(fake_download) == 2
+
+    def test_writes_to_temporary_file(self, fake_download):
+        import os
+        fname = wfs.resource('fisk:Sei_bw', 'imr_fisk')
+        assert fake_download[0] != fname
+        assert not os.path.exists(fake_download[0])
+        leftovers = [n for n in os.listdir(os.path.dirname(fname))
+                     if n.endswith('.tmp')]
+        assert leftovers == []
+
+    def test_keeps_old_file_when_download_fails(self, fake_download, monkeypatch):
+        fname = wfs.resource('fisk:Sei_bw', 'imr_fisk')
+
+        def failing_download(layer, url, outfile, fmt='netCDF'):
+            raise IOError('Connection lost')
+
+        monkeypatch.setattr(wfs, 'download_wfs_layer', failing_download)
+        with pytest.raises(IOError):
+            wfs.resource('fisk:Sei_bw', 'imr_fisk', recompute=True)
+        with open(fname) as f:
+            assert f.read() == 'partial complete'
+
+
+class Test_resource_revalidation:
+    @pytest.fixture()
+    def downloads(self, fake_wfs, monkeypatch):
+        calls = []
+
+        def download_wfs_layer(layer, url, outfile, fmt='netCDF'):
+            calls.append(outfile)
+            with open(outfile, 'w') as f:
+                f.write(f'download {len(calls)}')
+
+        monkeypatch.setattr(wfs, 'download_wfs_layer', download_wfs_layer)
+        wfs.resource('layer_262', 'fake')
+        return calls
+
+    def test_stores_server_metadata(self, downloads):
+        import json
+        fname = wfs.resource('layer_262', 'fake')
+        with open(str(fname) + '.json') as f:
+            metadata = json.load(f)
+        assert metadata['number_matched'] == 3
+        assert metadata['last_modified'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+    def test_does_not_download_when_unchanged(self, downloads, fake_wfs):
+        import os
+        fname = wfs.resource('layer_262', 'fake')
+        os.utime(fname, (0, 0))
+        wfs.resource('layer_262', 'fake', expires=1000)
+        assert len(downloads) == 1
+        assert fake_wfs.requests[-1]['resultType'] == 'hits'
+        assert os.path.getmtime(fname) > 0
+
+    def test_downloads_when_feature_count_changes(self, downloads, fake_wfs):
+        fake_wfs.number_matched = 4
+        fname = wfs.resource('layer_262', 'fake', expires=-1)
+        assert len(downloads) == 2
+        with open(fname) as f:
+            assert f.read() == 'download 2'
+
+    def test_downloads_when_last_modified_changes(self, downloads, fake_wfs):
+        fake_wfs.last_modified = 'Tue, 02 Jan 2024 00:00:00 GMT'
+        wfs.resource('layer_262', 'fake', expires=-1)
+        assert len(downloads) == 2
+
+    def test_downloads_when_only_feature_count_available(self, downloads, fake_wfs):
+        fake_wfs.last_modified = None
+        wfs.resource('layer_262', 'fake', expires=-1)
+        wfs.resource('layer_262', 'fake', expires=-1)
+        assert len(downloads) == 3
+
+    def test_does_not_download_when_fingerprint_unchanged(self, downloads, fake_wfs):
+        fake_wfs.last_modified = None
+        fields = ['idx', 'value']
+        wfs.resource('layer_262', 'fake', recompute=True, fingerprint=fields)
+        wfs.resource('layer_262', 'fake', expires=-1, fingerprint=fields)
+        wfs.resource('layer_262', 'fake', expires=-1, fingerprint=fields)
+        assert len(downloads) == 2
+        assert fake_wfs.requests[-1]['propertyName'] == 'idx,value'
+        assert fake_wfs.requests[-1]['sortBy'] == 'idx'
+
+    def test_downloads_when_fingerprint_changes(self, downloads, fake_wfs):
+        fake_wfs.last_modified = None
+        fields = ['idx', 'value']
+        wfs.resource('layer_262', 'fake', recompute=True, fingerprint=fields)
+        fake_wfs.value = lambda i: 2 * i
+        wfs.resource('layer_262', 'fake', expires=-1, fingerprint=fields)
+        assert len(downloads) == 3
+
+    def test_downloads_when_metadata_unavailable(self, downloads, fake_wfs):
+        fake_wfs.fail = True
+        wfs.resource('layer_262', 'fake', expires=-1)
+        assert len(downloads) == 2
+
+    def test_downloads_when_recompute(self, downloads):
+        wfs.resource('layer_262', 'fake', recompute=True)
+        assert len(downloads) == 2
+
+    def test_records_format_of_each_copy(self, downloads):
+        import json
+        fname = wfs.resource('layer_262', 'fake')
+        fname_parquet = wfs.resource('layer_262', 'fake', fmt='Parquet')
+        assert len(downloads) == 2
+        assert fname_parquet != fname
+        with open(str(fname_parquet) + '.json') as f:
+            assert json.load(f)['format'] == 'Parquet'
+        with open(str(fname) + '.json') as f:
+            assert json.load(f)['format'] == 'netCDF'
+
+    def test_raises_error_when_unknown_format(self, downloads):
+        with pytest.raises(ValueError):
+            wfs.resource('layer_262', 'fake', fmt='Shapefile')
+
+
+class Test_update:
+    @pytest.fixture()
+    def remote(self, fake_wfs, monkeypatch):
+        import re
+        import numpy as np
+        import xarray as xr
+
+        state = dict(
+            dset=xr.Dataset(dict(
+                loknr=('record', np.array([1, 2, 3])),
+                navn=('record', np.array([b'A', b'B', b'C'])),
+                endret=('record', np.array([b'2020-01-01T00:00:00'] * 3)),
+            )),
+            calls=[],
+        )
+
+        def download_wfs_layer(layer, url, outfile, where=None, select=None,
+                               fmt='netCDF', geometry=True):
+            state['calls'].append(dict(where=where, select=select))
+            dset = state['dset']
+            if where is not None:
+                in_match = re.match(r'loknr IN \((.*)\)', where)
+                if in_match:
+                    keys = [int(k) for k in in_match.group(1).split(',')]
+                    dset = dset.isel(record=np.isin(dset.loknr.values, keys))
+                else:
+                    since = re.match(r"endret > '(.*)'", where).group(1)
+                    dset = dset.isel(record=dset.endret.values > since.encode())
+            if select is not None:
+                dset = dset[select.split(',')]
+            dset.to_netcdf(outfile)
+
+        monkeypatch.setattr(wfs, 'download_wfs_layer', download_wfs_layer)
+        wfs.resource('layer_262', 'fake')
+        state['calls'].clear()
+        return state
+
+    def cached(self):
+        import xarray as xr
+        with xr.open_dataset(wfs.resource('layer_262', 'fake')) as dset:
+            return dset.load()
+
+    def test_adds_new_and_removes_deleted_features(self, remote):
+        import xarray as xr
+        remote['dset'] = xr.concat([
+            remote['dset'].isel(record=[0, 2]),
+            xr.Dataset(dict(
+                loknr=('record', [4]), navn=('record', [b'D']),
+                endret=('record', [b'2020-01-01T00:00:00']),
+            )),
+        ], dim='record')
+        wfs.update('layer_262', 'fake', key='loknr')
+        dset = self.cached()
+        assert dset.loknr.values.tolist() == [1, 3, 4]
+        assert dset.navn.values.tolist() == [b'A', b'C', b'D']
+        assert remote['calls'] == [
+            dict(where=None, select=None),
+            dict(where='loknr IN (4)', select=None),
+        ]
+
+    def test_replaces_features_with_modified_attributes(self, remote):
+        dset = remote['dset'].copy(deep=True)
+        dset.navn.values[1] = b'E'
+        remote['dset'] = dset
+        wfs.update('layer_262', 'fake', key='loknr')
+        cached = self.cached()
+        assert cached.loknr.values.tolist() == [1, 3, 2]
+        assert cached.navn.values.tolist() == [b'A', b'C', b'E']
+        assert remote['calls'][-1] == dict(where='loknr IN (2)', select=None)
+
+    def test_compares_only_selected_fields(self, remote):
+        dset = remote['dset'].copy(deep=True)
+        dset.navn.values[1] = b'E'
+        remote['dset'] = dset
+        wfs.update('layer_262', 'fake', key='loknr', compare=['endret'])
+        assert remote['calls'] == [dict(where=None, select='loknr,endret')]
+        assert self.cached().navn.values.tolist() == [b'A', b'B', b'C']
+
+    def test_downloads_only_attributes_when_unchanged(self, remote):
+        import os
+        fname = wfs.resource('layer_262', 'fake')
+        mtime = os.path.getmtime(fname)
+        wfs.update('layer_262', 'fake', key='loknr')
+        assert remote['calls'] == [dict(where=None, select=None)]
+        assert os.path.getmtime(fname) == mtime
+
+    def test_downloads_full_layer_when_not_mergeable(self, remote):
+        import numpy as np
+        import xarray as xr
+        fname = wfs.resource('layer_262', 'fake')
+        nodes = xr.Dataset(dict(x=('node', np.arange(5.))))
+        remote['dset'].merge(nodes).to_netcdf(fname)
+        wfs.update('layer_262', 'fake', key='loknr')
+        assert remote['calls'] == [dict(where=None, select=None)]
+        assert 'x' not in self.cached()
+
+    def test_keeps_polygons_consistent_when_written_by_gdal(self, fake_wfs, monkeypatch):
+        import re
+        from osgeo import ogr
+        remote = {1: 'POLYGON ((0 0,1 0,1 1,0 0))', 2: 'POLYGON ((5 5,6 5,6 7,5 5))'}
+
+        def download_wfs_layer(layer, url, outfile, where=None, select=None,
+                               fmt='netCDF', geometry=True):
+            keys = sorted(remote)
+            if where is not None:
+                keys = [int(k) for k in re.match(
+                    r'loknr IN \((.*)\)', where).group(1).split(',')]
+            dataSource = ogr.GetDriverByName('netCDF').CreateDataSource(str(outfile))
+            geom_type = ogr.wkbPolygon if geometry else ogr.wkbNone
+            layer = dataSource.CreateLayer('layer', None, geom_type)
+            layer.CreateField(ogr.FieldDefn('loknr', ogr.OFTInteger))
+            for k in keys:
+                feature = ogr.Feature(layer.GetLayerDefn())
+                feature.SetField('loknr', k)
+                if geometry:
+                    feature.SetGeometry(ogr.CreateGeometryFromWkt(remote[k]))
+                layer.CreateFeature(feature)
+            dataSource = None
+
+        monkeypatch.setattr(wfs, 'download_wfs_layer', download_wfs_layer)
+        wfs.resource('layer_203', 'fake')
+        remote[3] = 'POLYGON ((10 10,12 10,12 11,10 10))'
+        fname = wfs.update('layer_203', 'fake', key='loknr')
+
+        layer = ogr.Open(str(fname)).GetLayer()
+        result = {f.GetField('loknr'): f.GetGeometryRef().ExportToWkt() for f in layer}
+        assert result == remote
+
+    def test_replaces_features_changed_since_last_sync(self, remote):
+        dset = remote['dset'].copy(deep=True)
+        dset.navn.values[1] = b'E'
+        dset.endret.values[1] = b'2999-01-01T00:00:00'
+        remote['dset'] = dset
+        wfs.update('layer_262', 'fake', key='loknr', date_field='endret')
+        assert len(remote['calls']) == 1
+        assert remote['calls'][0]['where'].startswith("endret > '")
+        cached = self.cached()
+        assert cached.loknr.values.tolist() == [1, 3, 2]
+        assert cached.navn.values.tolist() == [b'A', b'C', b'E']
+
+    def test_quotes_string_keys(self):
+        assert wfs._in_filter('lokalitet', [b"12 O'Hara", b'13 B']) == (
+            "lokalitet IN ('12 O''Hara','13 B')")
+
+
+class Test_fetch_pages:
+    def test_returns_all_pages_in_order(self, fake_wfs):
+        import json
+        fake_wfs.number_matched = 25
+        pages = wfs.fetch_pages('fisk:Sei_bw', wfs.servers['fake'], page_size=10)
+        assert len(pages) == 3
+        idx = [f['properties']['idx'] for p in pages
+               for f in json.loads(p)['features']]
+        assert idx == list(range(25))
+
+    def test_fetches_pages_concurrently(self, fake_wfs):
+        fake_wfs.number_matched = 100
+        fake_wfs.delay = 0.1
+        wfs.fetch_pages('fisk:Sei_bw', wfs.servers['fake'], page_size=10,
+                        workers=4)
+        assert 1 < fake_wfs.max_in_flight <= 4
+
+    def test_returns_single_page_when_empty_layer(self, fake_wfs):
+        import json
+        fake_wfs.number_matched = 0
+        pages = wfs.fetch_pages('fisk:Sei_bw', wfs.servers['fake'])
+        assert len(pages) == 1
+        assert json.loads(pages[0])['features'] == []
+
+    def test_raises_error_when_server_fails(self, fake_wfs):
+        fake_wfs.fail = True
+        with pytest.raises(IOError):
+            wfs.fetch_pages('fisk:Sei_bw', wfs.servers['fake'])
+
+    def test_requests_sorted_pages(self, fake_wfs):
+        fake_wfs.number_matched = 25
+        wfs.fetch_pages('fisk:Sei_bw', wfs.servers['fake'], page_size=10,
+                        sort_by='idx')
+        pages = [r for r in fake_wfs.requests if 'startIndex' in r]
+        assert [r['sortBy'] for r in pages] == ['idx'] * 3
+
+    def test_raises_error_when_server_limits_page_size(self, fake_wfs):
+        fake_wfs.number_matched = 25
+        fake_wfs.max_count = 5
+        with pytest.raises(IOError):
+            wfs.fetch_pages('fisk:Sei_bw', wfs.servers['fake'], page_size=10)
+
+    def test_requests_given_output_format(self, fake_wfs, tmp_path):
+        fake_wfs.number_matched = 25
+        outfile = tmp_path.joinpath('out.nc')
+        wfs.download_wfs_layer_paged(
+            'fisk:Sei_bw', wfs.servers['fake'], outfile, 'idx', page_size=10,
+            output_format='geojson')
+        pages = [r for r in fake_wfs.requests if 'startIndex' in r]
+        assert [r['outputFormat'] for r in pages] == ['geojson'] * 3
+
+    def test_paged_download_assembles_all_features(self, fake_wfs, tmp_path):
+        from osgeo import ogr
+        fake_wfs.number_matched = 25
+        outfile = tmp_path.joinpath('out.nc')
+        wfs.download_wfs_layer_paged(
+            'fisk:Sei_bw', wfs.servers['fake'], outfile, 'idx', page_size=10)
+        layer = ogr.Open(str(outfile)).GetLayer()
+        assert [f.GetField('idx') for f in layer] == list(range(25))
+
+    def test_paged_download_keeps_field_types_when_pages_differ(
+            self, fake_wfs, tmp_path):
+        from osgeo import ogr
+        fake_wfs.number_matched = 25
+        fake_wfs.value = lambda i: i if i < 10 else i + 0.5
+        outfile = tmp_path.joinpath('out2.nc')
+        wfs.download_wfs_layer_paged(
+            'fisk:Sei_bw', wfs.servers['fake'], outfile, 'idx', fmt='netCDF',
+            page_size=10)
+        layer = ogr.Open(str(outfile)).GetLayer()
+        values = [f.GetField('value') for f in layer]
+        assert values == [i if i < 10 else i + 0.5 for i in range(25)]
+
+    def test_paged_download_requires_sort_field(self, fake_wfs):
+        with pytest.raises(ValueError):
+            wfs.resource('fisk:Sei_bw', 'fake', workers=2)